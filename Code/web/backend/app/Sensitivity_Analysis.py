@@ -1,6 +1,6 @@
 import copy
 import pandas as pd
-from quaci_class import QUACI
+from .quaci_class import QUACI
 
 
 class SensitivityAnalyzer:
@@ -13,28 +13,56 @@ def create_app():
 
     CORS(app)
 
+    # Serialize numpy arrays and DataFrames without building Python lists
+    from .utils.json_provider import NumpyJSONProvider
+    app.json = NumpyJSONProvider(app)
+
     # Load the config from config.py
     app.config.from_object('app.config.Config')
 
     # Initialize the database with the app
     db.init_app(app)
 
+    # Compress large JSON payloads for clients that accept it
+    from .utils.compression import init_compression
+    init_compression(app)
+
+    # Bounded concurrency and priority lanes for the compute routes
+    from .utils.scheduler import init_admission
+    init_admission(app)
+
+    # Pools views use for file I/O and engine calls
+    from .utils.executor import init_executors
+    init_executors(app)
+
     # Import models here to ensure they are registered with the app before db.create_all()
-    from .models import Space, House  # Import models
+    from .models import Space, House, PairComparison  # Import models
 
     # Create all database tables (this will create the tables defined by your models)
     with app.app_context():
+        # WAL mode and busy timeout on every pooled connection
+        from .utils.sqlite import init_sqlite
+        init_sqlite(app, db)
+
         db.create_all()  # Create tables if they don't exist
 
+        # Bring tables created by older versions up to date
+        from .utils.schema import upgrade_schema
+        upgrade_schema(db)
+
     # Register blueprints
     from .routes.spaces import spaces_bp
     from .routes.houses import houses_bp
     from .routes.analysis import analysis_bp
     from .routes.quaci_api import simulations_bp
+    from .routes.Sensitivity_api import sensitivity_bp
+    from .routes.metrics import metrics_bp
 
     app.register_blueprint(spaces_bp)
     app.register_blueprint(houses_bp)
     app.register_blueprint(analysis_bp)
     app.register_blueprint(simulations_bp)
+    app.register_blueprint(sensitivity_bp)
+    app.register_blueprint(metrics_bp)
 
     return app
@@ -4,4 +4,77 @@ import os
 class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///app.db'  # Path to your SQLite database
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_pre_ping': True,
+        # Pooled connections move between request threads
+        'connect_args': {'check_same_thread': False, 'timeout': 30}
+    }
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',  # Safe with WAL, fewer fsyncs
+        'busy_timeout': 30000,
+        'foreign_keys': 'ON'
+    }
+    PAGE_SIZE = 100  # Default page size of the space and house listings
+    MAX_PAGE_SIZE = 1000
     UPLOAD_FOLDER = 'instance/data'
+    UPLOAD_CHUNK_ROWS = 100_000  # Rows parsed at a time while ingesting a CSV
+    BULK_MAX_FILES = 200  # Houses accepted by one bulk upload
+    MAX_CONTENT_LENGTH = 4 * 1024 ** 3  # Largest request body, in bytes
+    UPLOAD_MAX_BYTES = 2 * 1024 ** 3  # Largest house CSV, uncompressed for zip members
+    BULK_MAX_BYTES = 8 * 1024 ** 3  # Largest uncompressed size of a bulk upload archive
+    SUMMARY_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]  # Stored per house and factor
+    # Default dtype of house matrices: float64, or float32, float16, int16
+    # and int8 for smaller, quantized copies (uploads can pick with 'storage')
+    MATRIX_STORAGE = 'float64'
+    # Whether uploads also keep their CSV next to the matrix, the only exact
+    # copy of a quantized house (uploads can pick with 'keep_csv')
+    KEEP_CSV = False
+    # Quantization errors, as a fraction of a factor's standard deviation,
+    # from which storage reports and analyses warn about them
+    QUANTIZATION_WARN_FRACTION = 0.01
+    # Whether uploads also write a sorted index (a factors x runs sorted
+    # copy of the matrix for fast distribution queries; uploads can pick
+    # with 'index'). Without one, only the stored summary quantiles are
+    # answered without sorting the factor
+    SORTED_INDEX = True
+
+    # Response compression, negotiated from the Accept-Encoding header
+    COMPRESS_ALGORITHMS = ['zstd', 'gzip']  # Server preference order
+    COMPRESS_MIMETYPES = ['application/json', 'text/csv', 'text/plain']
+    COMPRESS_MIN_SIZE = 1024  # Smaller bodies are sent as they are
+    COMPRESS_STREAM_SIZE = 1024 * 1024  # Larger bodies are compressed in chunks
+    COMPRESS_CHUNK_SIZE = 64 * 1024
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_ZSTD_LEVEL = 3
+
+    # Admission control for the compute routes (see app/utils/scheduler.py)
+    ADMISSION_MAX_CONCURRENT = 4
+    ADMISSION_BATCH_MAX_CONCURRENT = 2  # Keeps slots free for the UI
+    ADMISSION_MAX_QUEUE = {'interactive': 32, 'batch': 8}
+    ADMISSION_MAX_WAIT = 30  # Seconds before a queued request gets a 429
+
+    # waitress server started by wsgi.py; enough threads for every
+    # admitted and queued compute request plus the light routes
+    SERVER_HOST = '127.0.0.1'
+    SERVER_PORT = 5000
+    SERVER_THREADS = 64
+
+    # Pools views hand file I/O and engine calls to (see app/utils/executor.py)
+    IO_WORKERS = 16
+    CPU_WORKERS = os.cpu_count() or 2
+    CPU_EXECUTOR = 'thread'  # or 'process' to sidestep the GIL
+
+    # Upper bound on the temporary arrays of one pairwise analysis block
+    ANALYSIS_CHUNK_BYTES = 256 * 1024 * 1024
+    # Store pairwise discernibility counts as houses are uploaded
+    COMPARISON_CACHE = True
+    # Houses larger than this together are analysed block by block
+    ANALYSIS_MEMORY_BUDGET_MB = 512
+    ANALYSIS_MAX_BOOTSTRAP = 10_000  # Replicates allowed per discernibility request
+    # Default +/- error on each probability for approximate=true requests
+    ANALYSIS_DEFAULT_TOLERANCE = 0.01
+    # Full ranking permutations are only counted up to this many houses
+    RANKING_MAX_PERMUTATION_HOUSES = 8
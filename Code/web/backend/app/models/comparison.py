@@ -0,0 +1,19 @@
+from app import db
+
+
+class PairComparison(db.Model):
+    """Cached paired discernibility counts for two houses of a space"""
+    __tablename__ = 'pair_comparison'
+    __table_args__ = (db.UniqueConstraint('house1_id', 'house2_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    space_id = db.Column(db.Integer, db.ForeignKey('space.id'), nullable=False, index=True)
+    house1_id = db.Column(db.Integer, db.ForeignKey('house.id'), nullable=False)  # Always the lower id
+    house2_id = db.Column(db.Integer, db.ForeignKey('house.id'), nullable=False)
+    factors = db.Column(db.JSON, nullable=False)  # Factor order of the count lists
+    runs = db.Column(db.Integer, nullable=False)  # Paired runs compared
+    less_counts = db.Column(db.JSON, nullable=False)  # Runs where house1 < house2
+    greater_counts = db.Column(db.JSON, nullable=False)  # Runs where house1 > house2
+
+    def __repr__(self):
+        return f'<PairComparison {self.house1_id}-{self.house2_id}>'
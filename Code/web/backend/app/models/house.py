@@ -6,10 +6,21 @@ class House(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    space_id = db.Column(db.Integer, db.ForeignKey('space.id'), nullable=False)
-    file_path = db.Column(db.String(200), nullable=False)  # Path to CSV file
+    space_id = db.Column(db.Integer, db.ForeignKey('space.id'), nullable=False, index=True)
+    # Path to the uploaded CSV, None when only the matrix was kept
+    file_path = db.Column(db.String(200), nullable=True)
     simulations_count = db.Column(db.Integer, nullable=False)
     factors_count = db.Column(db.Integer, nullable=False)
+    # Binary runs x factors copy of the CSV, None for houses not converted
+    matrix_path = db.Column(db.String(200), nullable=True)
+    matrix_columns = db.Column(db.JSON, nullable=True)  # Column order of the matrix
+    # dtype, per-column offset/scale and max errors of a quantized matrix,
+    # None for float64
+    matrix_storage = db.Column(db.JSON, nullable=True)
+    # Factors x runs copy with every factor sorted, for CDF and quantile queries
+    index_path = db.Column(db.String(200), nullable=True)
+    # Per-factor count, mean, variance, min, max and quantiles of the runs
+    summary = db.Column(db.JSON, nullable=True)
 
     def __repr__(self):
         return f'<House {self.name}>'
@@ -1,8 +1,13 @@
 import os
+import threading
 import pandas as pd
 import numpy as np
 from scipy.stats import lognorm
 
+# Parsed material statistics per path, shared by every QUACI in the process
+_material_data = {}
+_material_lock = threading.Lock()
+
 
 class QUACI:
     Materials = [
@@ -110,7 +115,18 @@ class QUACI:
         self.material_dfs = {}
 
     def load_data(self) -> dict:
-
+        # The workbooks are parsed once per path; the simulation steps only
+        # read the frames, so instances share them through their own dict
+        with _material_lock:
+            if self.path not in _material_data:
+                self._parse_data()
+                if not self.data:
+                    # Nothing found: don't remember a missing directory
+                    return
+                _material_data[self.path] = self.data
+        self.data = dict(_material_data[self.path])
+
+    def _parse_data(self):
         for dirpath, dirnames, filenames in os.walk(self.path):
             for filename in filenames:
                 df = pd.read_excel(os.path.join(dirpath, filename))
@@ -322,7 +338,6 @@ class QUACI:
 
         return self.end
 
-
 '''
 This Portion of the code is made only for testing 
 this class .
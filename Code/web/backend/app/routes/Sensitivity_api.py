@@ -2,28 +2,25 @@ from flask import Blueprint, request, jsonify
 import pandas as pd
 from ..quaci_class import QUACI
 from ..Sensitivity_Analysis import SensitivityAnalyzer
+from ..utils.scheduler import admit, BATCH
 
 
 '''
-For This moment this part is unusable but it could be 
-in the future , What we are using for Sensitivity Analysis 
-is Embedded within the frontend ,  instead of Calculating 
-the Sensitivity Analysis in the backend then forwarding it 
-to the frontend. This technic Showed to have some major 
-errors due to the Json communication structure.
-Instead I opted to make the frontend forward  requests to calculate
-the Environmental Impacts through the quaci_class. This might be slow
-but it was a solution we needed as we had no time to solve 
-the errors manifested by the first technique.
-
+Backend one-at-a-time sensitivity analysis, served next to the quaci
+simulation routes. The frontend also computes its sensitivity analysis
+itself by forwarding requests to the quaci_class, which was the solution
+used while the JSON communication of this route had errors.
+The blueprint has its own name so it can share the /api/simulations
+prefix with quaci_api's blueprint.
 '''
 
 
-simulations_bp = Blueprint('simulations', __name__,
+sensitivity_bp = Blueprint('sensitivity', __name__,
                            url_prefix='/api/simulations')
 
 
-@simulations_bp.route('/quaci/sensitivity', methods=['POST'])
+@sensitivity_bp.route('/quaci/sensitivity', methods=['POST'])
+@admit(BATCH)
 def run_sensitivity_analysis():
     data = request.get_json()
 
@@ -60,8 +57,8 @@ def run_sensitivity_analysis():
         response_data = {
             'baseline': analyzer.baseline,
             'perturbation_percent': perturbation,
-            'full_results': full_results.where(pd.notnull(full_results), None).to_dict(orient='records'),
-            'top_parameters': top_results.where(pd.notnull(top_results), None).to_dict(orient='records')
+            'full_results': full_results,
+            'top_parameters': top_results
         }
 
         return jsonify(response_data), 200
@@ -1,12 +1,40 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from ..models import Space, House, db
-import pandas as pd
+from ..utils.comparison import (bootstrap_less_probabilities, heijungs_tensor,
+                                house_moments, less_probability_bounds,
+                                mean_over_factors, pair_indices,
+                                pairwise_less_counts, selected_pair_less_counts,
+                                stack_houses, unpaired_less_probabilities)
+from ..utils.comparison_cache import cached_discernability_counts
+from ..utils.executor import run_cpu, submit_io
+from ..utils.house_data import (house_source, iter_row_blocks, load_column,
+                                load_house, load_rows)
+from ..utils.pair_metrics import (DRD_QUANTILES, k4_metric, paired_metrics,
+                                  rank_counts, ranking_counts)
+from ..utils.quantization import storage_report
+from ..utils.scheduler import admit
+from ..utils.statistics import (RunningMoments, empirical_bernstein_bound,
+                                hoeffding_bound, hoeffding_sample_size,
+                                summary_arrays, summary_ranges)
 import numpy as np
 
 analysis_bp = Blueprint('analysis', __name__, url_prefix='/api/analysis')
 
+METRICS = ('smd', 'drd', 'k4', 'ranking', 'discernability', 'heijungs')
+
+# Options of run_analysis that only some methods honour
+METHOD_OPTIONS = {
+    'bootstrap': ('discernability_analysis',),
+    'approximate': ('discernability_analysis',),
+    'pairing': ('discernability_analysis',),
+    'prune': ('discernability_analysis',),
+    'permutations': ('ranking_probability',),
+    'per_factor': ('heijungs_metric',)
+}
+
 
 @analysis_bp.route('/<int:space_id>', methods=['POST'])
+@admit()
 def run_analysis(space_id):
     space = Space.query.get_or_404(space_id)
     data = request.get_json()
@@ -20,63 +48,681 @@ def run_analysis(space_id):
     if len(houses) < 2:
         return jsonify({'error': 'Need at least 2 houses for comparison'}), 400
 
-    # Load all CSVs into DataFrames
-    dfs = {}
-    for house in houses:
-        dfs[house.id] = pd.read_csv(house.file_path)
-
-    # Perform analysis
     if data['method'] == 'discernability_analysis':
-        results = _discernability_analysis(dfs)
+        method = _discernability_analysis
     elif data['method'] == 'heijungs_metric':
-        results = _heijungs_analysis(dfs)
+        method = _heijungs_analysis
+    elif data['method'] == 'ranking_probability':
+        method = _ranking_analysis
     else:
         return jsonify({'error': 'Invalid method'}), 400
 
+    # Settings the analysis needs, read here since it runs outside the app
+    options = {
+        'max_bytes': current_app.config['ANALYSIS_CHUNK_BYTES'],
+        'per_factor': bool(data.get('per_factor', False)),
+        'bootstrap': data.get('bootstrap', 0),
+        'confidence': data.get('confidence', 0.95),
+        'seed': data.get('seed'),
+        'pairing': data.get('pairing', 'paired'),
+        'approximate': bool(data.get('approximate', False)),
+        'prune': bool(data.get('prune', False)),
+        'permutations': bool(data.get('permutations', False)),
+        'tolerance': data.get('tolerance',
+                              current_app.config['ANALYSIS_DEFAULT_TOLERANCE']),
+        'memory_budget': data.get('memory_budget_mb',
+                                  current_app.config['ANALYSIS_MEMORY_BUDGET_MB'])
+    }
+    if isinstance(options['bootstrap'], bool) or not isinstance(options['bootstrap'], int):
+        return jsonify({'error': 'bootstrap must be an integer number of replicates'}), 400
+    seed = options['seed']
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)
+                             or seed < 0):
+        return jsonify({'error': 'seed must be a non-negative integer or null'}), 400
+    try:
+        options['confidence'] = float(options['confidence'])
+        options['tolerance'] = float(options['tolerance'])
+        options['memory_budget'] = int(float(options['memory_budget']) * 1024 * 1024)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'bootstrap, confidence, tolerance and memory_budget_mb must be numbers'}), 400
+    if options['memory_budget'] <= 0:
+        return jsonify({'error': 'memory_budget_mb must be positive'}), 400
+    if not 0 <= options['bootstrap'] <= current_app.config['ANALYSIS_MAX_BOOTSTRAP']:
+        return jsonify({'error': 'Invalid number of bootstrap replicates'}), 400
+    if not 0 < options['confidence'] < 1:
+        return jsonify({'error': 'confidence must be between 0 and 1'}), 400
+    if options['pairing'] not in ('paired', 'unpaired'):
+        return jsonify({'error': "pairing must be 'paired' or 'unpaired'"}), 400
+    if not 0 < options['tolerance'] < 0.5:
+        return jsonify({'error': 'tolerance must be between 0 and 0.5'}), 400
+
+    # Refuse options the method would otherwise ignore
+    requested = {
+        'bootstrap': options['bootstrap'] > 0,
+        'approximate': options['approximate'],
+        'pairing': options['pairing'] != 'paired',
+        'prune': options['prune'],
+        'permutations': options['permutations'],
+        'per_factor': options['per_factor']
+    }
+    unsupported = [name for name, methods in METHOD_OPTIONS.items()
+                   if requested[name] and data['method'] not in methods]
+    if unsupported:
+        return jsonify({'error': f"{data['method']} does not support {', '.join(unsupported)}"}), 400
+
+    if options['permutations'] and \
+            len(houses) > current_app.config['RANKING_MAX_PERMUTATION_HOUSES']:
+        return jsonify({'error': 'Too many houses to count full permutations'}), 400
+
+    try:
+        factors, run_range = _projection(data, houses, space)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if options['prune'] and (run_range is not None or options['bootstrap']
+                             or options['approximate']
+                             or options['pairing'] != 'paired'):
+        return jsonify({'error': 'prune only applies to exact paired analyses of all runs'}), 400
+
+    # Quick look: a random subset of runs, sized for the requested tolerance
+    if method is _discernability_analysis and options['approximate']:
+        if options['bootstrap']:
+            return jsonify({'error': 'Bootstrap is not available for approximate analyses'}), 400
+        sources = [house_source(house) for house in houses]
+        results = run_cpu(_approximate_discernability, sources, factors,
+                                run_range, options)
+        return _stored_results(results, houses, factors)
+
+    # Independent houses: every run of one against every run of the other,
+    # one factor at a time, whatever the mode
+    if method is _discernability_analysis and options['pairing'] == 'unpaired':
+        if options['bootstrap']:
+            return jsonify({'error': 'Bootstrap is only available for paired runs'}), 400
+        sources = [house_source(house) for house in houses]
+        results = run_cpu(_unpaired_analysis, sources, factors, run_range,
+                                options)
+        return _stored_results(results, houses, factors)
+
+    # Heijungs only needs moments, which uploads store per house
+    if method is _heijungs_analysis and run_range is None \
+            and all(house.summary for house in houses):
+        return jsonify(_heijungs_from_summaries(houses, factors, options))
+
+    # 'streaming' reads aligned row blocks within the memory budget instead
+    # of loading whole houses; without a mode it is picked automatically
+    # when the houses wouldn't fit the budget
+    mode = data.get('mode')
+    start, stop = run_range or (0, None)
+    house_rows = [max(0, min(house.simulations_count, stop or house.simulations_count) - start)
+                  for house in houses]
+    size = sum(house_rows) * len(factors) * 8
+    if options['bootstrap']:
+        # Bootstrap needs the houses in memory, plus its run weights
+        # (replicates x runs) and replicate totals (replicates x pairs x factors)
+        replicates = options['bootstrap']
+        n_pairs = len(houses) * (len(houses) - 1) // 2
+        working = (size + replicates * min(house_rows, default=0) * 2
+                   + replicates * n_pairs * len(factors) * 8)
+        if working > options['memory_budget']:
+            return jsonify({'error': 'Bootstrap working set exceeds the memory budget; '
+                                     'request fewer replicates, runs or factors'}), 400
+    if mode is None:
+        streaming = size > options['memory_budget']
+    elif mode in ('memory', 'streaming'):
+        streaming = mode == 'streaming'
+    else:
+        return jsonify({'error': 'Invalid mode'}), 400
+
+    # Pairs compared when their houses were uploaded are served as they are
+    if method is _discernability_analysis and not options['bootstrap'] \
+            and run_range is None:
+        cached = cached_discernability_counts(houses, factors)
+        if cached is not None:
+            counts, runs = cached
+            results = _discernability_results(
+                [house.id for house in houses], factors,
+                _less_probabilities(counts, runs), runs, options)
+            return _stored_results(results, houses, factors)
+
+    # Pairs that the stored summaries already settle within the tolerance
+    # are not compared; only the houses of the other pairs are read, in
+    # row blocks when they wouldn't fit the memory budget
+    if method is _discernability_analysis and options['prune']:
+        runs = min(house.simulations_count for house in houses)
+        lower, upper = _summary_bounds(houses, factors, runs)
+        decided = ((lower >= 1 - options['tolerance'])
+                   | (upper <= options['tolerance'])).all(axis=1)
+        rows, cols = pair_indices(len(houses))
+        needed = sorted(set(rows[~decided].tolist()) | set(cols[~decided].tolist()))
+        if mode is None:
+            streaming = len(needed) * runs * len(factors) * 8 > options['memory_budget']
+        results = run_cpu(_pruned_discernability,
+                                [house_source(house) for house in houses], factors,
+                                needed, runs, lower, upper, decided, streaming,
+                                options)
+        return _stored_results(results, houses, factors)
+
+    if streaming:
+        if options['bootstrap']:
+            return jsonify({'error': 'Bootstrap is not available in streaming mode'}), 400
+        sources = [house_source(house) for house in houses]
+        results = run_cpu(_streaming_analysis, data['method'], sources,
+                                factors, run_range, options)
+        return _stored_results(results, houses, factors)
+
+    # Load the selected columns and runs of all houses, in parallel; the
+    # analysis takes the frames over, so nothing else may keep them
+    futures = [submit_io(load_house, house, factors, run_range) for house in houses]
+    dfs = {house.id: future.result() for house, future in zip(houses, futures)}
+    del futures
+
+    # Perform analysis on the compute pool
+    results = run_cpu(method, dfs, options)
+
+    return _stored_results(results, houses, factors)
+
+
+@analysis_bp.route('/<int:space_id>/metrics', methods=['POST'])
+@admit()
+def compare_metrics(space_id):
+    """Any subset of METRICS for every pair of houses, from one load.
+
+    Houses are loaded once and the pairwise metrics share a single pass
+    over the aligned runs, so only the results leave the server.
+    'ranking' is the houses x ranks probability matrix of each factor;
+    "permutations": true adds the probability of every full ordering.
+    """
+    space = Space.query.get_or_404(space_id)
+    data = request.get_json()
+
+    if not data or 'house_ids' not in data:
+        return jsonify({'error': 'Missing house_ids'}), 400
+
+    houses = House.query.filter(House.id.in_(data['house_ids'])).all()
+    if len(houses) < 2:
+        return jsonify({'error': 'Need at least 2 houses for comparison'}), 400
+
+    metrics = data.get('metrics') or list(METRICS)
+    if not isinstance(metrics, list) or not set(metrics) <= set(METRICS):
+        return jsonify({'error': f"metrics must be a list of {', '.join(METRICS)}"}), 400
+
+    options = {
+        'max_bytes': current_app.config['ANALYSIS_CHUNK_BYTES'],
+        'lambda': data.get('lambda', 0.05),
+        'drd_threshold': data.get('drd_threshold', 0.05),
+        'permutations': bool(data.get('permutations', False))
+    }
+    try:
+        options['lambda'] = float(options['lambda'])
+        options['drd_threshold'] = float(options['drd_threshold'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'lambda and drd_threshold must be numbers'}), 400
+
+    # Full orderings grow with the factorial of the house count, so they
+    # are only counted on request and for a few houses
+    if options['permutations']:
+        if 'ranking' not in metrics:
+            return jsonify({'error': 'permutations requires the ranking metric'}), 400
+        if len(houses) > current_app.config['RANKING_MAX_PERMUTATION_HOUSES']:
+            return jsonify({'error': 'Too many houses to count full permutations'}), 400
+
+    try:
+        factors, run_range = _projection(data, houses, space)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    futures = [submit_io(load_house, house, factors, run_range) for house in houses]
+    dfs = {house.id: future.result() for house, future in zip(houses, futures)}
+    del futures
+
+    results = run_cpu(_metrics_analysis, dfs, factors, metrics, options)
+    return _stored_results(results, houses, factors)
+
+
+def _stored_results(results, houses, factors):
+    """Response of an analysis that read the houses' matrices, noting the
+    houses whose values it saw quantized and warning when their errors are
+    large next to the spread of a factor"""
+    quantized = {house.id: storage_report(
+                     house.matrix_storage, house.matrix_columns, house.summary,
+                     factors, current_app.config['QUANTIZATION_WARN_FRACTION'])
+                 for house in houses if house.matrix_storage is not None}
+    if quantized:
+        results['quantized'] = quantized
+        warnings = [f"House {house_id}: {report['warning']}"
+                    for house_id, report in quantized.items() if 'warning' in report]
+        if warnings:
+            results['warning'] = '; '.join(warnings)
     return jsonify(results)
 
 
-def _discernability_analysis(dfs):
+def _projection(data, houses, space):
+    """Factors and run range a request is restricted to; ValueError if invalid"""
+    # Optional projection: only these factors, only runs [start, stop)
+    factors = data.get('factors') or houses[0].matrix_columns or space.factors
+    if not isinstance(factors, list) \
+            or not all(isinstance(factor, str) for factor in factors) \
+            or not set(factors) <= set(space.factors):
+        raise ValueError('factors must be a list of the space factors')
+    run_range = data.get('runs')
+    if run_range is not None:
+        try:
+            start, stop = run_range
+            start = int(start)
+            stop = None if stop is None else int(stop)
+        except (TypeError, ValueError):
+            raise ValueError('runs must be [start, stop]')
+        if start < 0 or (stop is not None and stop <= start):
+            raise ValueError('runs must be [start, stop] with 0 <= start < stop')
+        runs = min(house.simulations_count for house in houses)
+        if start >= runs:
+            raise ValueError(f'runs must start before {runs}, the runs of the shortest house')
+        run_range = (start, stop)
+    return factors, run_range
+
+
+def _metrics_analysis(dfs, factors, metrics, options):
+    house_ids = list(dfs.keys())
+    # Heijungs uses every run of each house, so its moments come first
+    if 'heijungs' in metrics:
+        _, means, variances = house_moments(list(dfs.values()), factors)
+    # Pairwise metrics compare run k of one house with run k of the other
+    runs = min(len(df) for df in dfs.values())
+    stack = stack_houses(_take_frames(dfs), factors, runs)
+
+    paired = paired_metrics(stack, metrics, options['max_bytes'],
+                            options['drd_threshold'])
+    if 'k4' in metrics:
+        paired['k4'] = k4_metric(stack.mean(axis=1), options['lambda'])
+    if 'heijungs' in metrics:
+        tensor = heijungs_tensor(means, variances)
+        paired['heijungs'] = tensor[pair_indices(len(house_ids))]
+    if 'discernability' in paired:
+        paired['discernability'] = _less_probabilities(paired['discernability'], runs)
+
+    comparisons = []
+    for p, (i, j) in enumerate(zip(*pair_indices(len(house_ids)))):
+        comparison = {'house1': house_ids[i], 'house2': house_ids[j]}
+        for metric, values in paired.items():
+            if metric == 'drd':
+                comparison['drd'] = {
+                    key: values[key][p] for key in
+                    ('mean', 'min', 'max', 'below_zero', 'indifferent')}
+                comparison['drd']['quantiles'] = {
+                    str(q): values['quantiles'][k][p]
+                    for k, q in enumerate(DRD_QUANTILES)}
+            else:
+                comparison[metric] = values[p]
+        comparisons.append(comparison)
+
+    results = {
+        'house_ids': house_ids,
+        'factors': factors,
+        'runs': runs,
+        'comparisons': comparisons
+    }
+    if 'ranking' in metrics:
+        permutations = ranking_counts(stack, options['max_bytes']) \
+            if options['permutations'] else None
+        ranking = _ranking_results(house_ids, factors,
+                                   rank_counts(stack, options['max_bytes']), runs,
+                                   permutations)
+        results['ranking'] = ranking['rank_probabilities']
+        if permutations is not None:
+            results['ranking_permutations'] = ranking['permutations']
+    return results
+
+
+def _ranking_permutations(house_ids, factors, counts, runs):
+    # Orderings from lowest to highest value, most frequent first
+    return {
+        factor: [{'ranking': [house_ids[h] for h in ordering],
+                  'probability': count / runs}
+                 for ordering, count in sorted(factor_counts.items(),
+                                               key=lambda item: -item[1])]
+        for factor, factor_counts in zip(factors, counts)
+    }
+
+
+def _discernability_analysis(dfs, options):
     # Get factor names from first house's dataframe
     factors = list(dfs.values())[0].columns.tolist()
+    house_ids = list(dfs.keys())
 
+    # Runs are compared pairwise (run k of one house against run k of the
+    # other), so houses with more runs are cut to the shortest one
+    runs = min(len(df) for df in dfs.values())
+    stack = stack_houses(_take_frames(dfs), factors, runs)
+
+    # P(house1 < house2) per factor for every pair, in one broadcast pass
+    counts = pairwise_less_counts(stack, options['max_bytes'])
+
+    # Percentile bootstrap intervals, all pairs and factors at once
+    intervals = None
+    if options.get('bootstrap') and runs:
+        replicates = bootstrap_less_probabilities(
+            stack, options['bootstrap'], options.get('seed'), options['max_bytes'])
+        alpha = 1 - options['confidence']
+        intervals = np.quantile(replicates, [alpha / 2, 1 - alpha / 2], axis=0)
+
+    return _discernability_results(house_ids, factors,
+                                   _less_probabilities(counts, runs), runs,
+                                   options, intervals)
+
+
+def _take_frames(dfs):
+    # The frames leave the dict so stack_houses can free each one once copied
+    frames = list(dfs.values())
+    dfs.clear()
+    return frames
+
+
+def _unpaired_analysis(sources, factors, run_range, options):
+    """P(run of house1 < run of house2) over all combinations of runs.
+
+    Houses may have different run counts. Each factor is read and sorted
+    once per house, then compared by binary search, so only one factor of
+    every house is in memory at a time.
+    """
+    house_ids = [source['id'] for source in sources]
+    probabilities = np.empty((len(pair_indices(len(sources))[0]), len(factors)))
+    runs = {}
+    for f, factor in enumerate(factors):
+        columns = []
+        for source in sources:
+            values = load_column(source, factor, run_range)
+            runs.setdefault(source['id'], len(values))
+            columns.append(np.sort(values[~np.isnan(values)]))
+        probabilities[:, f] = unpaired_less_probabilities(columns)
+
+    results = _discernability_results(house_ids, factors, probabilities, runs,
+                                      options)
+    results['pairing'] = 'unpaired'
+    return results
+
+
+def _approximate_discernability(sources, factors, run_range, options):
+    """Discernibility on a uniform random subset of runs.
+
+    The subset is as small as Hoeffding's inequality allows for every
+    probability, across all pairs and factors at once (union bound), to be
+    within +/- tolerance with the requested confidence. Paired runs share
+    one subset; unpaired houses are each subsampled on their own, and the
+    same bound holds for the two-sample estimate with the smaller sample.
+    The bound actually achieved is reported, tightened per probability
+    with the empirical Bernstein bound for paired runs.
+    """
+    house_ids = [source['id'] for source in sources]
+    n_pairs = len(pair_indices(len(sources))[0])
+    # Half of the risk for each of the two bounds, split over all estimates
+    delta = (1 - options['confidence']) / (2 * n_pairs * len(factors))
+    target = hoeffding_sample_size(options['tolerance'], delta)
+
+    rng = np.random.default_rng(options.get('seed'))
+    start, stop = run_range or (0, None)
+    available = [max(0, min(source['runs'], source['runs'] if stop is None else stop) - start)
+                 for source in sources]
+
+    bounds = None
+    if options['pairing'] == 'unpaired':
+        samples = [load_rows(source, factors, _sample_rows(rng, rows, target) + start)
+                   for source, rows in zip(sources, available)]
+        probabilities = np.empty((n_pairs, len(factors)))
+        for f in range(len(factors)):
+            columns = [np.sort(sample[:, f][~np.isnan(sample[:, f])])
+                       for sample in samples]
+            probabilities[:, f] = unpaired_less_probabilities(columns)
+        sizes = [len(sample) for sample in samples]
+        exact = sizes == available
+        bound = 0.0 if exact else float(hoeffding_bound(min(sizes), 2 * delta))
+        runs = dict(zip(house_ids, sizes))
+    else:
+        common = min(available)
+        rows = _sample_rows(rng, common, target) + start
+        stack = np.stack([load_rows(source, factors, rows) for source in sources])
+        runs = len(rows)
+        probabilities = _less_probabilities(
+            pairwise_less_counts(stack, options['max_bytes']), runs)
+        exact = runs == common
+        if exact:
+            bounds = np.zeros(probabilities.shape)
+        else:
+            bounds = np.minimum(hoeffding_bound(runs, delta),
+                                empirical_bernstein_bound(probabilities, runs, delta))
+        bound = float(bounds.max()) if bounds.size else 0.0
+
+    results = _discernability_results(house_ids, factors, probabilities, runs,
+                                      options)
+    if bounds is not None:
+        for comparison, error in zip(results['comparisons'], bounds):
+            comparison['error_bound'] = error
+    if options['pairing'] == 'unpaired':
+        results['pairing'] = 'unpaired'
+    results['approximation'] = {
+        'tolerance': options['tolerance'],
+        'confidence': options['confidence'],
+        'sample_runs': target,
+        'exact': exact,
+        'bound': bound
+    }
+    return results
+
+
+def _sample_rows(rng, n_rows, size):
+    # Sorted so that memory-mapped reads move forward through the file
+    if size >= n_rows:
+        return np.arange(n_rows)
+    return np.sort(rng.choice(n_rows, size, replace=False))
+
+
+def _summary_bounds(houses, factors, runs):
+    # Summaries describe all of a house's runs, so they only bound the
+    # analysed runs of houses without extra or missing (NaN) values
+    usable = [bool(house.summary) and house.simulations_count == runs
+              and all(house.summary[f]['count'] == runs for f in factors)
+              for house in houses]
+    blank = {f: {'count': 0, 'mean': None, 'variance': None,
+                 'min': None, 'max': None} for f in factors}
+    summaries = [house.summary if ok else blank
+                 for house, ok in zip(houses, usable)]
+    _, means, variances = summary_arrays(summaries, factors)
+    minimums, maximums = summary_ranges(summaries, factors)
+    return less_probability_bounds(means, variances, minimums, maximums)
+
+
+def _pruned_discernability(sources, factors, needed, runs, lower, upper,
+                           decided, streaming, options):
+    """Discernibility where decided pairs are answered from their bounds.
+
+    `needed` are the positions of the houses the remaining pairs compare.
+    They are read at once, or with `streaming` in aligned row blocks that
+    fit half of the memory budget, like _streaming_analysis. Decided pairs
+    get the middle of their bounds, which is within the tolerance of the
+    exact value.
+    """
+    house_ids = [source['id'] for source in sources]
+    probabilities = (lower + upper) / 2
+    ambiguous = np.flatnonzero(~decided)
+    if len(ambiguous):
+        positions = {h: k for k, h in enumerate(needed)}
+        rows, cols = pair_indices(len(sources))
+        rows = np.array([positions[h] for h in rows[ambiguous]])
+        cols = np.array([positions[h] for h in cols[ambiguous]])
+        if streaming:
+            max_bytes = options['memory_budget'] // 2
+            block_rows = max(1, max_bytes // (len(needed) * len(factors) * 8))
+        else:
+            max_bytes = options['max_bytes']
+            block_rows = max(1, runs)
+
+        counts = np.zeros((len(ambiguous), len(factors)), dtype=np.int64)
+        for block in iter_row_blocks([sources[h] for h in needed], factors,
+                                     block_rows, (0, runs)):
+            common = min(len(values) for values in block)
+            if common == 0:
+                break
+            stack = np.stack([values[:common] for values in block])
+            counts += selected_pair_less_counts(stack, rows, cols, max_bytes)
+        probabilities[ambiguous] = _less_probabilities(counts, runs)
+
+    results = _discernability_results(house_ids, factors, probabilities, runs,
+                                      options)
+    for p in np.flatnonzero(decided):
+        results['comparisons'][p].update({
+            'pruned': True, 'lower': lower[p], 'upper': upper[p]})
+    results['pruning'] = {
+        'tolerance': options['tolerance'],
+        'mode': 'streaming' if streaming else 'memory',
+        'pruned_pairs': int(decided.sum()),
+        'compared_pairs': len(ambiguous)
+    }
+    return results
+
+
+def _less_probabilities(counts, runs):
+    return counts / runs if runs else np.full(counts.shape, np.nan)
+
+
+def _discernability_results(house_ids, factors, probabilities, runs, options,
+                            intervals=None):
     comparisons = []
+    for p, (i, j) in enumerate(zip(*pair_indices(len(house_ids)))):
+        comparison = {
+            'house1': house_ids[i],
+            'house2': house_ids[j],
+            'values': probabilities[p]
+        }
+        if intervals is not None:
+            comparison['ci_lower'] = intervals[0][p]
+            comparison['ci_upper'] = intervals[1][p]
+        comparisons.append(comparison)
+
+    results = {
+        'factors': factors,
+        'runs': runs,
+        'comparisons': comparisons
+    }
+    if options.get('bootstrap'):
+        results['bootstrap'] = {
+            'replicates': options['bootstrap'],
+            'confidence': options['confidence']
+        }
+    return results
+
+
+def _streaming_analysis(method, sources, factors, run_range, options):
+    """Run an analysis over aligned row blocks read from all houses at once.
+
+    Only one block per house is in memory at a time: half of the memory
+    budget goes to the blocks, the other half to comparison temporaries.
+    Discernibility accumulates pairwise counts, ranking accumulates rank
+    counts and Heijungs accumulates per-house moments.
+    """
+    house_ids = [source['id'] for source in sources]
+    half_budget = options['memory_budget'] // 2
+    block_rows = max(1, half_budget // (len(sources) * len(factors) * 8))
+    blocks = iter_row_blocks(sources, factors, block_rows, run_range)
+
+    if method == 'discernability_analysis':
+        counts = np.zeros((len(pair_indices(len(sources))[0]), len(factors)),
+                          dtype=np.int64)
+        runs = 0
+        for block in blocks:
+            # Paired runs end with the shortest house
+            common = min(len(values) for values in block)
+            if common == 0:
+                break
+            stack = np.stack([values[:common] for values in block])
+            counts += pairwise_less_counts(stack, half_budget)
+            runs += common
+        return _discernability_results(house_ids, factors,
+                                       _less_probabilities(counts, runs), runs,
+                                       options)
+
+    if method == 'ranking_probability':
+        counts = np.zeros((len(factors), len(sources), len(sources)), dtype=np.int64)
+        permutations = [{} for _ in factors] if options.get('permutations') else None
+        runs = 0
+        for block in blocks:
+            # Every house needs a value to be ranked
+            common = min(len(values) for values in block)
+            if common == 0:
+                break
+            stack = np.stack([values[:common] for values in block])
+            counts += rank_counts(stack, half_budget)
+            if permutations is not None:
+                for merged, block_counts in zip(permutations,
+                                                ranking_counts(stack, half_budget)):
+                    for ordering, count in block_counts.items():
+                        merged[ordering] = merged.get(ordering, 0) + count
+            runs += common
+        return _ranking_results(house_ids, factors, counts, runs, permutations)
+
+    moments = [RunningMoments(len(factors)) for _ in sources]
+    for block in blocks:
+        for accumulator, values in zip(moments, block):
+            accumulator.update(values)
+    means = np.array([m.mean for m in moments])
+    variances = np.array([m.variance() for m in moments])
+    return _heijungs_from_moments(house_ids, factors, means, variances, options)
+
+
+def _ranking_analysis(dfs, options):
+    factors = list(dfs.values())[0].columns.tolist()
     house_ids = list(dfs.keys())
 
-    for i in range(len(house_ids)):
-        for j in range(i+1, len(house_ids)):
-            house1_id = house_ids[i]
-            house2_id = house_ids[j]
-            df1 = dfs[house1_id]
-            df2 = dfs[house2_id]
-
-            # Calculate probability for each factor
-            probabilities = []
-            for factor in factors:
-                better = np.mean(df1[factor] < df2[factor])
-                probabilities.append(float(better))
-
-            comparisons.append({
-                'house1': house1_id,
-                'house2': house2_id,
-                'values': probabilities
-            })
+    # Houses are ranked run by run, so all are cut to the shortest one
+    runs = min(len(df) for df in dfs.values())
+    stack = stack_houses(_take_frames(dfs), factors, runs)
+    counts = rank_counts(stack, options['max_bytes'])
+    permutations = ranking_counts(stack, options['max_bytes']) \
+        if options.get('permutations') else None
+    return _ranking_results(house_ids, factors, counts, runs, permutations)
 
-    return {
+
+def _ranking_results(house_ids, factors, counts, runs, permutations=None):
+    """Houses x ranks probability matrix per factor, rank 1 being the lowest"""
+    probabilities = counts / runs if runs else np.full(counts.shape, np.nan)
+    results = {
+        'house_ids': house_ids,
         'factors': factors,
-        'comparisons': comparisons
+        'runs': runs,
+        'rank_probabilities': dict(zip(factors, probabilities))
     }
+    if permutations is not None:
+        results['permutations'] = _ranking_permutations(
+            house_ids, factors, permutations, runs)
+    return results
+
+
+def _heijungs_analysis(dfs, options):
+    factors = list(dfs.values())[0].columns.tolist()
+
+    # Moments are computed once per house, not once per pair
+    _, means, variances = house_moments(list(dfs.values()), factors)
+    return _heijungs_from_moments(list(dfs.keys()), factors, means, variances,
+                                  options)
+
+
+def _heijungs_from_summaries(houses, factors, options):
+    _, means, variances = summary_arrays(
+        [house.summary for house in houses], factors)
+    return _heijungs_from_moments([house.id for house in houses], factors,
+                                  means, variances, options)
+
 
+def _heijungs_from_moments(house_ids, factors, means, variances, options):
+    per_factor = heijungs_tensor(means, variances)
+    metrics = np.round(mean_over_factors(per_factor), 4)
 
-def _heijungs_analysis(dfs):
-    # Implement Heijungs metric logic
-    metrics = {}
-    for house1_id, df1 in dfs.items():
-        metrics[house1_id] = {}
-        for house2_id, df2 in dfs.items():
-            # Example implementation
-            diff = df1.mean() - df2.mean()
-            std = np.sqrt(df1.var() + df2.var())
-            metric = np.mean(diff / std)
-            metrics[house1_id][house2_id] = round(float(metric), 4)
-    return {'heijungs_metrics': metrics}
+    results = {'heijungs_metrics': {
+        house1_id: dict(zip(house_ids, row))
+        for house1_id, row in zip(house_ids, metrics.tolist())
+    }}
+    if options.get('per_factor'):
+        # Full houses x houses x factors tensor, indexed like house_ids
+        results.update({
+            'house_ids': house_ids,
+            'factors': factors,
+            'per_factor': np.round(per_factor, 4)
+        })
+    return results
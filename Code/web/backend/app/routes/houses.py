@@ -1,9 +1,20 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-from ..utils.csv_validation import validate_csv_factors
 from ..models import Space, House, db
-import pandas as pd
+from ..utils.executor import run_io, submit_io
+from ..utils.comparison_cache import schedule_pair_updates
+from ..utils.house_data import append_csv, house_source, ingest_csv, load_column
+from ..utils.quantization import STORAGE_DTYPES, storage_report
+from ..utils.sorted_index import sorted_quantiles, threshold_counts, valid_values
+from ..utils.statistics import RunningMoments
+from contextlib import contextmanager
+import functools
 import os
+import threading
+import uuid
+import zipfile
+import numpy as np
+import pandas as pd
 
 houses_bp = Blueprint('houses', __name__,
                       url_prefix='/api/spaces/<int:space_id>/houses')
@@ -21,39 +32,404 @@ def upload_house(space_id):
     if file.filename == '':
         return jsonify({'error': 'Empty filename'}), 400
 
-    # Validate CSV structure
     try:
-        df = pd.read_csv(file.stream)
-        validate_csv_factors(df.columns.tolist(), space.factors)
+        storage, index, keep_csv = _storage_args()
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
 
-    # Get the absolute path for the 'instance/data' directory
-    file_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', '..', 'instance', 'data')
+    file_path = _house_file(space_id)
 
-    # Ensure the directory exists
-    if not os.path.exists(file_dir):
-        os.makedirs(file_dir)
-
-    # Save the file
-    filename = secure_filename(f"{space_id}_{file.filename}")
-    file_path = os.path.join(file_dir, filename)
-    file.stream.seek(0)  # Ensure the file stream is at the beginning
-    file.save(file_path)
+    # Validate the header, then save the CSV and its binary matrix while
+    # type-checking the rows, all in one pass over the upload
+    try:
+        fields = run_io(
+            ingest_csv, _CappedStream(file.stream, current_app.config['UPLOAD_MAX_BYTES']),
+            file_path, space.factors,
+            current_app.config['UPLOAD_CHUNK_ROWS'],
+            current_app.config['SUMMARY_QUANTILES'], storage, index, keep_csv)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # Create house record
     new_house = House(
-        name=request.form.get('name', filename),
+        name=request.form.get('name', secure_filename(file.filename)),
         space_id=space_id,
-        file_path=file_path,
-        simulations_count=len(df),
-        factors_count=len(df.columns)
+        **fields
     )
     db.session.add(new_house)
     db.session.commit()
 
+    # Only the N-1 new pairs need comparing; done after the response
+    schedule_pair_updates(new_house.id)
+
     return jsonify({
         'id': new_house.id,
         'name': new_house.name,
-        'simulations': new_house.simulations_count
+        'simulations': new_house.simulations_count,
+        'storage': _storage_report(new_house)
     }), 201
+
+
+@houses_bp.route('/bulk', methods=['POST'])
+def upload_houses_bulk(space_id):
+    """Upload several house CSVs at once, as 'files' fields or a zip 'archive'.
+
+    Files are validated and parsed in parallel; every valid one becomes a
+    House and all of them are committed in one transaction. The response
+    lists the outcome of each file, including files that could not be
+    read at all. Each file, or uncompressed zip member, is limited to
+    UPLOAD_MAX_BYTES and a whole archive to BULK_MAX_BYTES.
+    """
+    space = Space.query.get_or_404(space_id)
+
+    try:
+        storage, index, keep_csv = _storage_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        uploads = _bulk_uploads()
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'error': str(e)}), 400
+    if not uploads:
+        return jsonify({'error': 'No CSV files uploaded'}), 400
+    if len(uploads) > current_app.config['BULK_MAX_FILES']:
+        return jsonify({'error': f"At most {current_app.config['BULK_MAX_FILES']} files per upload"}), 400
+
+    file_dir = _data_dir()
+    report = [{'filename': name} for name, _, _ in uploads]
+    tasks = {}
+    max_bytes = current_app.config['UPLOAD_MAX_BYTES']
+    for entry, (name, open_upload, size) in zip(report, uploads):
+        if not secure_filename(name).lower().endswith('.csv'):
+            entry['error'] = 'Not a CSV file'
+        elif size is not None and size > max_bytes:
+            entry['error'] = f'File is larger than {max_bytes} bytes'
+        else:
+            entry['file_path'] = _house_file(space_id, file_dir)
+            tasks[entry['file_path']] = submit_io(
+                _ingest_upload, open_upload, max_bytes, entry['file_path'],
+                space.factors, current_app.config['UPLOAD_CHUNK_ROWS'],
+                current_app.config['SUMMARY_QUANTILES'], storage, index, keep_csv)
+
+    outcomes = {path: future.exception() or future.result()
+                for path, future in tasks.items()}
+
+    new_houses = []
+    for entry in report:
+        if 'error' in entry:
+            continue
+        outcome = outcomes[entry['file_path']]
+        if isinstance(outcome, (ValueError, zipfile.BadZipFile)):
+            entry['error'] = str(outcome)
+            continue
+        if isinstance(outcome, Exception):
+            # e.g. zip members with an unsupported compression or a password;
+            # ingest_csv has removed whatever the file had written
+            current_app.logger.warning('Bulk upload of %s failed: %r',
+                                       entry['filename'], outcome)
+            entry['error'] = f'Could not read file: {outcome}'
+            continue
+
+        house = House(
+            name=secure_filename(entry['filename']),
+            space_id=space_id,
+            **outcome
+        )
+        new_houses.append((entry, house))
+
+    # One transaction for the whole batch
+    db.session.add_all([house for _, house in new_houses])
+    db.session.commit()
+
+    for entry, house in new_houses:
+        entry.update({'id': house.id, 'name': house.name,
+                      'simulations': house.simulations_count,
+                      'storage': _storage_report(house)})
+    for entry in report:
+        entry.pop('file_path', None)
+
+    schedule_pair_updates(*(house.id for _, house in new_houses))
+
+    status = 201 if new_houses else 400
+    return jsonify({'created': len(new_houses), 'files': report}), status
+
+
+@houses_bp.route('/<int:house_id>/simulations', methods=['POST'])
+def append_simulations(space_id, house_id):
+    """Append the runs of an uploaded CSV to an existing house.
+
+    Only the new rows are parsed: the stored moments are merged with
+    theirs and cached comparisons are extended over the new runs in the
+    background. New runs are merged into the sorted index, which gives
+    the updated quantiles; houses without one drop their stored quantiles
+    rather than sort every factor again.
+    """
+    house = House.query.filter_by(id=house_id, space_id=space_id).first_or_404()
+
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    # Appends to the same house are applied one at a time
+    with _house_lock(house.id):
+        db.session.refresh(house)
+        columns = house.matrix_columns or \
+            pd.read_csv(house.file_path, nrows=0).columns.tolist()
+        try:
+            added, moments, quantiles, storage = run_io(
+                append_csv, file.stream, house.file_path, house.matrix_path,
+                columns, current_app.config['UPLOAD_CHUNK_ROWS'],
+                house.index_path, current_app.config['SUMMARY_QUANTILES'],
+                house.matrix_storage)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        house.simulations_count += added
+        house.matrix_storage = storage
+        if house.summary:
+            merged = RunningMoments.from_summary(house.summary, columns)
+            merged.merge(moments)
+            house.summary = merged.to_summary(columns, quantiles)
+        db.session.commit()
+
+    if added:
+        schedule_pair_updates(house.id)
+
+    return jsonify({
+        'id': house.id,
+        'name': house.name,
+        'added': added,
+        'simulations': house.simulations_count
+    })
+
+
+@houses_bp.route('/<int:house_id>/summary', methods=['GET'])
+def get_house_summary(space_id, house_id):
+    house = House.query.filter_by(id=house_id, space_id=space_id).first_or_404()
+    if house.summary is None:
+        return jsonify({'error': 'No summary stored for this house'}), 404
+    return jsonify({
+        'id': house.id,
+        'name': house.name,
+        'simulations_count': house.simulations_count,
+        'summary': house.summary,
+        'storage': house.matrix_storage or {'dtype': 'float64'}
+    })
+
+
+_append_locks = {}  # House id -> [lock, appends holding or waiting for it]
+_append_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _house_lock(house_id):
+    # A house's entry is dropped with the last append using it
+    with _append_locks_guard:
+        entry = _append_locks.setdefault(house_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _append_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _append_locks[house_id]
+
+
+@houses_bp.route('/<int:house_id>/distribution', methods=['GET'])
+def get_house_distribution(space_id, house_id):
+    """CDF, threshold counts and quantiles of one factor of a house.
+
+    ?factor=<name>, then any of ?x=<v1>,<v2> (thresholds) and
+    ?q=<p1>,<p2> (probabilities). Each value costs one binary search in
+    the house's sorted index; houses uploaded without one answer the
+    stored summary quantiles as they are and have the factor sorted for
+    any other query.
+    """
+    house = House.query.filter_by(id=house_id, space_id=space_id).first_or_404()
+    try:
+        factor, thresholds, probabilities = _distribution_args(house.space.factors)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(_distribution(house, factor, thresholds, probabilities))
+
+
+@houses_bp.route('/distribution', methods=['GET'])
+def get_space_distribution(space_id):
+    """The house distribution query for every house of the space, or for
+    ?house_ids=<id1>,<id2>, e.g. to find the lowest 95th percentile"""
+    space = Space.query.get_or_404(space_id)
+    try:
+        factor, thresholds, probabilities = _distribution_args(space.factors)
+        house_ids = _list_arg('house_ids', int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    query = House.query.filter_by(space_id=space_id)
+    if house_ids:
+        query = query.filter(House.id.in_(house_ids))
+    houses = [_distribution(house, factor, thresholds, probabilities)
+              for house in query.order_by(House.id)]
+    return jsonify({'factor': factor, 'houses': houses})
+
+
+def _storage_report(house):
+    return storage_report(house.matrix_storage, house.matrix_columns, house.summary,
+                          warn_fraction=current_app.config['QUANTIZATION_WARN_FRACTION'])
+
+
+def _storage_args():
+    """'storage' dtype, 'index' and 'keep_csv' flags of an upload form"""
+    storage = request.form.get('storage', current_app.config['MATRIX_STORAGE'])
+    if storage not in STORAGE_DTYPES:
+        raise ValueError(f"storage must be one of {', '.join(STORAGE_DTYPES)}")
+    return (storage, _flag_arg('index', current_app.config['SORTED_INDEX']),
+            _flag_arg('keep_csv', current_app.config['KEEP_CSV']))
+
+
+def _flag_arg(name, default):
+    value = request.form.get(name)
+    if value is None:
+        return default
+    if value.lower() not in ('true', 'false', '1', '0'):
+        raise ValueError(f"{name} must be 'true' or 'false'")
+    return value.lower() in ('true', '1')
+
+
+def _distribution_args(factors):
+    factor = request.args.get('factor')
+    if factor not in factors:
+        raise ValueError('factor must be one of the space factors')
+    thresholds = _list_arg('x', float)
+    probabilities = _list_arg('q', float)
+    if not all(0 <= p <= 1 for p in probabilities):
+        raise ValueError('q must be between 0 and 1')
+    return factor, thresholds, probabilities
+
+
+def _list_arg(name, convert):
+    value = request.args.get(name, '')
+    try:
+        return [convert(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise ValueError(f'{name} must be a comma-separated list of numbers')
+
+
+def _distribution(house, factor, thresholds, probabilities):
+    # A quantized house's index holds its encoded values
+    storage, column = None, 0
+    if house.index_path and os.path.exists(house.index_path):
+        column = house.matrix_columns.index(factor)
+        row = np.load(house.index_path, mmap_mode='r')[column]
+        storage = house.matrix_storage
+    elif not thresholds and _summary_quantiles(house, factor, probabilities):
+        stored = house.summary[factor]
+        result = {
+            'id': house.id,
+            'name': house.name,
+            'count': stored['count'],
+            'quantiles': {str(p): stored['quantiles'][str(p)] for p in probabilities}
+        }
+        if house.matrix_storage is not None:
+            result['storage'] = _storage_report(house)
+        return result
+    else:
+        row = np.sort(load_column(house_source(house), factor))
+    result = {
+        'id': house.id,
+        'name': house.name,
+        'count': len(valid_values(row))
+    }
+    if thresholds:
+        result['thresholds'] = threshold_counts(row, thresholds, storage, column)
+    if probabilities:
+        points = sorted_quantiles(row, probabilities, storage, column)
+        result['quantiles'] = dict(zip(map(str, probabilities), points))
+    if house.matrix_storage is not None:
+        result['storage'] = _storage_report(house)
+    return result
+
+
+def _summary_quantiles(house, factor, probabilities):
+    """Whether the stored summary holds every requested quantile of the factor"""
+    stored = (house.summary or {}).get(factor) or {}
+    quantiles = stored.get('quantiles')
+    return quantiles is not None and all(str(p) in quantiles for p in probabilities)
+
+
+def _data_dir():
+    # Get the absolute path for the 'instance/data' directory
+    file_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', '..', 'instance', 'data')
+
+    # Ensure the directory exists
+    if not os.path.exists(file_dir):
+        os.makedirs(file_dir)
+    return file_dir
+
+
+def _house_file(space_id, file_dir=None):
+    """CSV path of a new house, which also names its matrix and index
+    whether or not the CSV is kept. Every house gets its own name, so
+    re-uploading a file or uploading it twice at once never shares the
+    CSV, matrix, index or their temporary files with another house."""
+    return os.path.join(file_dir or _data_dir(), f"{space_id}_{uuid.uuid4().hex}.csv")
+
+
+def _bulk_uploads():
+    """(filename, stream opener, uncompressed size or None) of every file
+    sent to the bulk endpoint. Zip members are only opened by the task
+    that reads them, so one that can't be opened fails on its own."""
+    uploads = [(file.filename, lambda stream=file.stream: stream, None)
+               for file in request.files.getlist('files') if file.filename]
+
+    archive = request.files.get('archive')
+    if archive is not None and archive.filename:
+        # Zip members are read straight from the archive, nothing is extracted
+        bundle = zipfile.ZipFile(archive.stream)
+        members = [member for member in bundle.infolist()
+                   if not member.is_dir()
+                   and not os.path.basename(member.filename).startswith('.')
+                   and os.path.basename(member.filename)
+                   and not member.filename.startswith('__MACOSX/')]
+        # Sizes come from the archive's directory, and members never yield
+        # more than their stated size, so this bounds what gets written
+        if sum(member.file_size for member in members) > current_app.config['BULK_MAX_BYTES']:
+            raise ValueError(f"Archive unpacks to more than {current_app.config['BULK_MAX_BYTES']} bytes")
+        uploads += [(os.path.basename(member.filename),
+                     functools.partial(bundle.open, member), member.file_size)
+                    for member in members]
+    return uploads
+
+
+def _ingest_upload(open_upload, max_bytes, *args):
+    return ingest_csv(_CappedStream(open_upload(), max_bytes), *args)
+
+
+class _CappedStream:
+    """Binary stream that raises ValueError once more than `max_bytes`
+    have been read from it"""
+
+    def __init__(self, stream, max_bytes):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.count = 0
+
+    def read(self, size=-1):
+        return self._counted(self.stream.read(self._limit(size)))
+
+    def readline(self, size=-1):
+        return self._counted(self.stream.readline(self._limit(size)))
+
+    def _limit(self, size):
+        # Never ask for more than one byte past the cap
+        remaining = self.max_bytes - self.count + 1
+        return remaining if size is None or size < 0 else min(size, remaining)
+
+    def _counted(self, data):
+        self.count += len(data)
+        if self.count > self.max_bytes:
+            raise ValueError(f'File is larger than {self.max_bytes} bytes')
+        return data
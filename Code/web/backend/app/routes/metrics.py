@@ -0,0 +1,9 @@
+from flask import Blueprint, current_app, jsonify
+
+metrics_bp = Blueprint('metrics', __name__, url_prefix='/api/metrics')
+
+
+@metrics_bp.route('/scheduler', methods=['GET'])
+def get_scheduler_metrics():
+    # Queue depth, running requests and rejections per priority lane
+    return jsonify(current_app.extensions['admission'].metrics())
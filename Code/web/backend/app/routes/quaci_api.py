@@ -2,10 +2,15 @@ from flask import Blueprint, request, jsonify
 import pandas as pd
 import os
 from ..quaci_class import QUACI
+from ..utils.scheduler import ServerBusy, admission_slot, busy_response
+from ..utils.singleflight import SingleFlight, canonical_key
 
 simulations_bp = Blueprint('simulations', __name__,
                            url_prefix='/api/simulations')
 
+# Identical simulations requested at the same time share one QUACI run
+_inflight = SingleFlight()
+
 
 @simulations_bp.route('/quaci', methods=['POST'])
 def run_quaci_simulation():
@@ -17,29 +22,20 @@ def run_quaci_simulation():
         return jsonify({'error': 'Missing required fields: comp_quantity, building_type, dur_vie_mean, dur_vie_std_dev'}), 400
 
     try:
-        # Convert comp_quantity dict to pandas Series with building_type as name
-        comp_quantity = pd.Series(
-            data['comp_quantity'],
-            name=data['building_type']
-        )
-
-        # Initialize QUACI instance
-        quaci = QUACI(
-            comp_quantity=comp_quantity,
-            dur_vie_mean=float(data['dur_vie_mean']),
-            dur_vie_std_dev=float(data['dur_vie_std_dev']),
-            path='Material_Statistics'  # Path to material statistics
-        )
-
-        # Run simulation and get result dataframe
-        result_df = quaci.final(data['building_type'])
+        dur_vie_mean = float(data['dur_vie_mean'])
+        dur_vie_std_dev = float(data['dur_vie_std_dev'])
 
-        # Convert dataframe to JSON-friendly format
-        result_json = result_df.where(pd.notnull(
-            result_df), None).to_dict(orient='records')
+        key = canonical_key('quaci', data['comp_quantity'], data['building_type'],
+                            dur_vie_mean, dur_vie_std_dev)
+        result_df = _inflight.do(key, _simulate, (data['comp_quantity'],
+                                 data['building_type'], dur_vie_mean,
+                                 dur_vie_std_dev))
 
-        return jsonify(result_json), 200
+        # The app's JSON provider writes the dataframe as records, NaN as null
+        return jsonify(result_df), 200
 
+    except ServerBusy:
+        return busy_response()
     except ValueError as e:
         return jsonify({'error': f'Invalid numeric value: {str(e)}'}), 400
     except FileNotFoundError as e:
@@ -48,3 +44,26 @@ def run_quaci_simulation():
         return jsonify({'error': f'Missing material data: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': f'Simulation failed: {str(e)}'}), 500
+
+
+def _simulate(params):
+    # Only the caller that runs the simulation takes an admission slot;
+    # the identical requests waiting for its result don't hold one
+    with admission_slot():
+        return _run_quaci(*params)
+
+
+def _run_quaci(comp_quantity, building_type, dur_vie_mean, dur_vie_std_dev):
+    # Convert comp_quantity dict to pandas Series with building_type as name
+    comp_quantity = pd.Series(comp_quantity, name=building_type)
+
+    # Initialize QUACI instance
+    quaci = QUACI(
+        comp_quantity=comp_quantity,
+        dur_vie_mean=dur_vie_mean,
+        dur_vie_std_dev=dur_vie_std_dev,
+        path='Material_Statistics'  # Path to material statistics
+    )
+
+    # Run simulation and get results
+    return quaci.final(building_type)
@@ -1,4 +1,5 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
+from sqlalchemy import func
 from ..models import Space, House, db
 from ..utils.csv_validation import validate_csv_factors
 import os
@@ -8,14 +9,32 @@ spaces_bp = Blueprint('spaces', __name__, url_prefix='/api/spaces')
 
 @spaces_bp.route('', methods=['GET'])
 def get_spaces():
-    # Fetch all spaces without filtering by user_id
-    spaces = Space.query.all()
-    return jsonify([{
-        'id': space.id,
-        'name': space.name,
-        'factors': space.factors,
-        'house_count': len(space.houses)
-    } for space in spaces])
+    try:
+        limit, cursor = _page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Fetch one page of spaces with their house counts in a single query
+    rows = db.session.query(Space, func.count(House.id)) \
+        .outerjoin(House, House.space_id == Space.id) \
+        .filter(Space.id > cursor) \
+        .group_by(Space.id) \
+        .order_by(Space.id) \
+        .limit(limit + 1) \
+        .all()
+
+    # Paged like the houses of get_space: pass next_cursor back as ?cursor=
+    # to fetch the following page; it is null on the last one
+    next_cursor = rows[limit - 1][0].id if len(rows) > limit else None
+    return jsonify({
+        'spaces': [{
+            'id': space.id,
+            'name': space.name,
+            'factors': space.factors,
+            'house_count': house_count
+        } for space, house_count in rows[:limit]],
+        'next_cursor': next_cursor
+    })
 
 
 @spaces_bp.route('', methods=['POST'])
@@ -36,14 +55,47 @@ def create_space():
 @spaces_bp.route('/<int:space_id>', methods=['GET'])
 def get_space(space_id):
     space = Space.query.get_or_404(space_id)
-    return jsonify({
-        'id': space.id,
-        'name': space.name,
-        'factors': space.factors,
-        'houses': [{
+    # ?include=summary adds the per-factor statistics stored at upload
+    include_summary = request.args.get('include') == 'summary'
+    try:
+        limit, cursor = _page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    page = House.query \
+        .filter(House.space_id == space_id, House.id > cursor) \
+        .order_by(House.id) \
+        .limit(limit + 1) \
+        .all()
+    next_cursor = page[limit - 1].id if len(page) > limit else None
+
+    houses = []
+    for house in page[:limit]:
+        entry = {
             'id': house.id,
             'name': house.name,
             'simulations_count': house.simulations_count,
             'factors_count': house.factors_count
-        } for house in space.houses]
+        }
+        if include_summary:
+            entry['summary'] = house.summary
+        houses.append(entry)
+
+    return jsonify({
+        'id': space.id,
+        'name': space.name,
+        'factors': space.factors,
+        'houses': houses,
+        'next_cursor': next_cursor
     })
+
+
+def _page_args():
+    """?limit= and ?cursor= (the last id of the previous page) of a listing"""
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE'], type=int)
+    cursor = request.args.get('cursor', 0, type=int)
+    if limit is None or not 0 < limit <= current_app.config['MAX_PAGE_SIZE']:
+        raise ValueError(
+            f"limit must be between 1 and {current_app.config['MAX_PAGE_SIZE']}")
+    return limit, cursor or 0
+
@@ -0,0 +1,181 @@
+import numpy as np
+
+
+def stack_houses(dfs, factors, runs=None):
+    """Stack a list of house DataFrames into one houses x runs x factors
+    float64 array.
+
+    Columns are taken by name, in `factors` order. Houses are cut to the
+    first `runs` rows (default: the smallest run count among them) so that
+    run k of every house lines up for paired comparisons. Each entry of
+    `dfs` is set to None once copied, so a frame nothing else refers to is
+    freed before the next one is stacked and the frames and the stack
+    never both sit in memory whole.
+    """
+    if runs is None:
+        runs = min(len(df) for df in dfs)
+
+    stack = np.empty((len(dfs), runs, len(factors)), dtype=np.float64)
+    for h, df in enumerate(dfs):
+        stack[h] = df[factors].to_numpy(dtype=np.float64)[:runs]
+        dfs[h] = df = None
+    return stack
+
+
+def pair_indices(n_houses):
+    """Row and column indices of all pairs i < j, in row-major order"""
+    return np.triu_indices(n_houses, k=1)
+
+
+def pairwise_less_counts(stack, max_bytes=256 * 1024 * 1024):
+    """Count, for every pair i < j and factor, the runs where house i < house j.
+
+    Returns a pairs x factors int64 array ordered like pair_indices. Work
+    is split in blocks of runs, each house compared with the houses after
+    it, so that the boolean comparison tensor never exceeds `max_bytes`.
+    """
+    n_houses, n_runs, n_factors = stack.shape
+    counts = np.zeros((len(pair_indices(n_houses)[0]), n_factors), dtype=np.int64)
+    # The pairs (i, j > i) of house i are contiguous in pair_indices order
+    starts = np.concatenate(([0], np.cumsum(np.arange(n_houses - 1, 0, -1))))
+
+    # Largest run block for which one house against all others fits the budget
+    run_block = max(1, min(n_runs, max_bytes // max(1, n_houses * n_factors)))
+    for r0 in range(0, n_runs, run_block):
+        runs = stack[:, r0:r0 + run_block]
+        for i in range(n_houses - 1):
+            # Only the houses after i, so each pair is compared once
+            less = runs[i] < runs[i + 1:]
+            counts[starts[i]:starts[i + 1]] += np.count_nonzero(less, axis=1)
+    return counts
+
+
+def selected_pair_less_counts(stack, rows, cols, max_bytes=256 * 1024 * 1024):
+    """Like pairwise_less_counts, for the pairs (rows[p], cols[p]) only"""
+    _, n_runs, n_factors = stack.shape
+    counts = np.empty((len(rows), n_factors), dtype=np.int64)
+    # Two float slices and the boolean result per pair block
+    pair_block = max(1, max_bytes // max(1, n_runs * n_factors * 17))
+    for p0 in range(0, len(rows), pair_block):
+        p1 = min(p0 + pair_block, len(rows))
+        counts[p0:p1] = np.count_nonzero(
+            stack[rows[p0:p1]] < stack[cols[p0:p1]], axis=1)
+    return counts
+
+
+def less_probability_bounds(means, variances, minimums, maximums):
+    """Bounds on P(house i < house j) over paired runs, from per-house
+    moments and ranges, for every pair i < j and factor.
+
+    Without the pairing, the standard deviation of the run differences is
+    at most sd_i + sd_j, and Cantelli's inequality bounds the share of
+    runs on the wrong side of the mean difference by var / (var + diff^2).
+    Disjoint ranges settle a probability exactly. NaN inputs give [0, 1].
+    Returns pairs x factors lower and upper arrays ordered like pair_indices.
+    """
+    rows, cols = pair_indices(len(means))
+    diff = means[rows] - means[cols]
+    spread = (np.sqrt(variances[rows]) + np.sqrt(variances[cols])) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tail = spread / (spread + diff ** 2)
+
+    lower = np.zeros(diff.shape)
+    upper = np.ones(diff.shape)
+    known = ~np.isnan(tail)
+    below = known & (diff < 0)
+    above = known & (diff > 0)
+    lower[below] = 1 - tail[below]
+    upper[above] = tail[above]
+
+    always_less = maximums[rows] < minimums[cols]
+    never_less = minimums[rows] >= maximums[cols]
+    lower[always_less] = upper[always_less] = 1.0
+    lower[never_less] = upper[never_less] = 0.0
+    return lower, upper
+
+
+def unpaired_less_probabilities(columns):
+    """P(x < y) over all combinations of runs, for every pair i < j.
+
+    `columns` holds one sorted 1-D array per house (one factor, NaN
+    removed). For each run x of house i, the runs of house j above it are
+    found with a binary search, so a pair costs O(n log m) instead of
+    comparing all n * m combinations. Returns a float array ordered like
+    pair_indices, NaN where a house has no runs.
+    """
+    rows, cols = pair_indices(len(columns))
+    probabilities = np.full(len(rows), np.nan)
+    for p, (i, j) in enumerate(zip(rows, cols)):
+        x, y = columns[i], columns[j]
+        if len(x) and len(y):
+            # Ties count as neither lower nor higher, like the paired test
+            not_greater = np.searchsorted(y, x, side='right').sum()
+            probabilities[p] = (len(x) * len(y) - not_greater) / (len(x) * len(y))
+    return probabilities
+
+
+def bootstrap_less_probabilities(stack, replicates, seed=None,
+                                 max_bytes=256 * 1024 * 1024):
+    """Bootstrap replicates of P(house i < house j) for every pair and factor.
+
+    The resampling is drawn once, as a replicates x runs matrix of how
+    often each run is picked, and shared by all pairs and factors: each
+    replicate's probability is a weighted count of the runs where house i
+    is lower, computed for a whole block of runs with one matrix product.
+    Returns a replicates x pairs x factors array ordered like pair_indices.
+    """
+    n_houses, n_runs, n_factors = stack.shape
+    rows, cols = pair_indices(n_houses)
+    n_pairs = len(rows)
+    rng = np.random.default_rng(seed)
+
+    # Run multiplicities per replicate; a run is picked far fewer than
+    # 65536 times, so uint16 keeps this matrix small
+    weights = np.empty((replicates, n_runs), dtype=np.uint16)
+    uniform = np.full(n_runs, 1.0 / n_runs)
+    rep_block = max(1, max_bytes // max(1, n_runs * 8))
+    for b0 in range(0, replicates, rep_block):
+        b1 = min(b0 + rep_block, replicates)
+        weights[b0:b1] = rng.multinomial(n_runs, uniform, size=b1 - b0)
+
+    totals = np.zeros((replicates, n_pairs * n_factors), dtype=np.float64)
+    per_run = n_pairs * n_factors * 20 + replicates * 4
+    run_block = max(1, min(n_runs, max_bytes // per_run))
+    for r0 in range(0, n_runs, run_block):
+        r1 = min(r0 + run_block, n_runs)
+        less = stack[rows, r0:r1] < stack[cols, r0:r1]
+        # runs x (pairs * factors) indicator matrix for this block
+        indicator = less.transpose(1, 0, 2).reshape(r1 - r0, -1)
+        totals += weights[:, r0:r1].astype(np.float32) @ indicator.astype(np.float32)
+
+    return (totals / n_runs).reshape(replicates, n_pairs, n_factors)
+
+
+def house_moments(dfs, factors):
+    """Per-house run count, mean and sample variance, each houses x factors"""
+    counts = np.empty((len(dfs), len(factors)), dtype=np.int64)
+    means = np.empty((len(dfs), len(factors)), dtype=np.float64)
+    variances = np.empty((len(dfs), len(factors)), dtype=np.float64)
+    for h, df in enumerate(dfs):
+        values = df[factors]
+        counts[h] = values.count().to_numpy()
+        means[h] = values.mean().to_numpy()
+        variances[h] = values.var().to_numpy()
+    return counts, means, variances
+
+
+def heijungs_tensor(means, variances):
+    """(mean_i - mean_j) / sqrt(var_i + var_j) as a houses x houses x factors array"""
+    diff = means[:, None, :] - means[None, :, :]
+    std = np.sqrt(variances[:, None, :] + variances[None, :, :])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return diff / std
+
+
+def mean_over_factors(tensor):
+    """Average the last axis, skipping NaN entries like pandas does"""
+    valid = ~np.isnan(tensor)
+    total = np.where(valid, tensor, 0.0).sum(axis=-1)
+    count = valid.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 0, total / count, np.nan)
@@ -0,0 +1,180 @@
+import numpy as np
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from ..models import House, PairComparison, db
+from .comparison import pair_indices
+from .executor import run_cpu
+from .house_data import house_source, iter_row_blocks
+
+
+def schedule_pair_updates(*house_ids):
+    """Compare new or grown houses with the rest of their space in the
+    background.
+
+    Houses are processed one after the other by a single job, so pairs
+    between two new houses are only computed once.
+    """
+    if not current_app.config['COMPARISON_CACHE'] or not house_ids:
+        return
+    app = current_app._get_current_object()
+    current_app.extensions['executors']['io'].submit(_update_pairs, app, house_ids)
+
+
+def _update_pairs(app, house_ids):
+    with app.app_context():
+        for house_id in house_ids:
+            try:
+                extend_pairs(house_id)
+                compute_new_pairs(house_id)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception(
+                    'Updating cached comparisons for house %s failed', house_id)
+        db.session.remove()
+
+
+def compute_new_pairs(house_id):
+    """Store discernibility counts between a house and every house of its
+    space that it hasn't been compared with yet.
+
+    All the pairs are counted in one pass over aligned row blocks, within
+    the analysis memory budget and on the compute pool, then stored one
+    at a time.
+    """
+    house = db.session.get(House, house_id)
+    if house is None:
+        return
+
+    factors = house.matrix_columns or house.space.factors
+    cached = {pair_id for row in PairComparison.query.filter(
+        (PairComparison.house1_id == house_id) | (PairComparison.house2_id == house_id))
+        for pair_id in (row.house1_id, row.house2_id)}
+    others = House.query \
+        .filter(House.space_id == house.space_id, House.id != house_id) \
+        .order_by(House.id) \
+        .all()
+
+    missing = [other for other in others if other.id not in cached]
+    if not missing:
+        return
+
+    sources = [house_source(house)] + [house_source(other) for other in missing]
+    less, greater = run_cpu(less_greater_counts, sources, factors, _memory_budget())
+    for k, other in enumerate(missing):
+        runs = min(house.simulations_count, other.simulations_count)
+        db.session.add(pair_comparison(house, other, factors, runs, less[k], greater[k]))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another upload's job stored this pair first
+            db.session.rollback()
+
+
+def extend_pairs(house_id):
+    """Bring the cached pairs of a house up to date after runs were appended.
+
+    Only the paired runs a pair's counts don't cover yet are read, in
+    row blocks within the analysis memory budget, and compared; their
+    counts are added to the stored ones.
+    """
+    house = db.session.get(House, house_id)
+    if house is None:
+        return
+
+    rows = PairComparison.query.filter(
+        (PairComparison.house1_id == house_id) | (PairComparison.house2_id == house_id)).all()
+    for row in rows:
+        house1 = db.session.get(House, row.house1_id)
+        house2 = db.session.get(House, row.house2_id)
+        if house1 is None or house2 is None:
+            continue
+        runs = min(house1.simulations_count, house2.simulations_count)
+        if runs <= row.runs:
+            continue
+
+        added_less, added_greater = run_cpu(
+            less_greater_counts, [house_source(house1), house_source(house2)],
+            row.factors, _memory_budget(), (row.runs, runs))
+        less = np.asarray(row.less_counts) + added_less[0]
+        greater = np.asarray(row.greater_counts) + added_greater[0]
+        # Only applies if no other job extended the pair in the meantime
+        PairComparison.query.filter_by(id=row.id, runs=row.runs).update({
+            'less_counts': less.tolist(),
+            'greater_counts': greater.tolist(),
+            'runs': runs
+        }, synchronize_session=False)
+        db.session.commit()
+
+
+def less_greater_counts(sources, factors, budget, runs=None):
+    """Runs where the first house of `sources` is lower, and higher, than
+    each of the others, over the paired runs of each pair.
+
+    Houses are read together in aligned row blocks sized so that the blocks
+    and their comparison stay within `budget` bytes; `runs` = (start, stop)
+    limits the rows read. Returns two (houses - 1) x factors int64 arrays.
+    """
+    n_factors = len(factors)
+    # A float64 block per house and the boolean result of one comparison
+    block_rows = max(1, budget // (len(sources) * n_factors * 8 + n_factors))
+    less = np.zeros((len(sources) - 1, n_factors), dtype=np.int64)
+    greater = np.zeros_like(less)
+    for first, *others in iter_row_blocks(sources, factors, block_rows, runs):
+        # Paired runs end with the first house or the last of the others
+        if not len(first) or not any(len(block) for block in others):
+            break
+        for k, block in enumerate(others):
+            n = min(len(first), len(block))
+            less[k] += np.count_nonzero(first[:n] < block[:n], axis=0)
+            greater[k] += np.count_nonzero(first[:n] > block[:n], axis=0)
+    return less, greater
+
+
+def pair_comparison(house_a, house_b, factors, runs, less, greater):
+    """PairComparison row from the counts of paired runs where house_a is
+    lower and higher than house_b"""
+    if house_b.id < house_a.id:
+        house_a, house_b, less, greater = house_b, house_a, greater, less
+
+    return PairComparison(
+        space_id=house_a.space_id,
+        house1_id=house_a.id,
+        house2_id=house_b.id,
+        factors=list(factors),
+        runs=runs,
+        less_counts=np.asarray(less).tolist(),
+        greater_counts=np.asarray(greater).tolist()
+    )
+
+
+def _memory_budget():
+    return int(current_app.config['ANALYSIS_MEMORY_BUDGET_MB'] * 1024 * 1024)
+
+
+def cached_discernability_counts(houses, factors):
+    """Pairwise less-than counts for `houses` from the cache, ordered like
+    pair_indices, or None when any pair is missing or out of date.
+
+    Only used when all houses have the same number of runs, where the
+    cached per-pair counts equal what run_analysis would compute.
+    """
+    runs = {house.simulations_count for house in houses}
+    if len(runs) != 1:
+        return None
+    runs = runs.pop()
+
+    ids = [house.id for house in houses]
+    rows = PairComparison.query.filter(
+        PairComparison.house1_id.in_(ids), PairComparison.house2_id.in_(ids)).all()
+    by_pair = {(row.house1_id, row.house2_id): row for row in rows}
+
+    rows_idx, cols_idx = pair_indices(len(ids))
+    counts = np.empty((len(rows_idx), len(factors)), dtype=np.int64)
+    for p, (i, j) in enumerate(zip(rows_idx, cols_idx)):
+        row = by_pair.get((min(ids[i], ids[j]), max(ids[i], ids[j])))
+        if row is None or row.runs != runs:
+            return None
+        order = [row.factors.index(factor) for factor in factors]
+        stored = row.less_counts if ids[i] < ids[j] else row.greater_counts
+        counts[p] = np.asarray(stored)[order]
+    return counts, runs
@@ -0,0 +1,100 @@
+import zlib
+from flask import current_app, request
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+
+def init_compression(app):
+    """Register transparent response compression on the app"""
+    app.after_request(compress_response)
+
+
+def available_encodings(app):
+    """Encodings the server can produce, in order of preference"""
+    encodings = []
+    for encoding in app.config['COMPRESS_ALGORITHMS']:
+        if encoding == 'zstd' and zstandard is None:
+            continue
+        encodings.append(encoding)
+    return encodings
+
+
+def compress_response(response):
+    config = current_app.config
+
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in config['COMPRESS_MIMETYPES']:
+        return response
+
+    # File responses are sent straight from disk, leave them alone
+    if response.direct_passthrough:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(
+        available_encodings(current_app))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # Generator bodies of unknown size are always compressed on the fly
+        response.response = _stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < config['COMPRESS_MIN_SIZE']:
+            return response
+
+        if len(body) >= config['COMPRESS_STREAM_SIZE']:
+            # Large payloads go out chunk by chunk instead of being
+            # compressed into a second full-size buffer first
+            response.response = _stream(
+                _chunks(body, config['COMPRESS_CHUNK_SIZE']), encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(_compress(body, encoding))
+
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _compressor(encoding):
+    config = current_app.config
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(
+            level=config['COMPRESS_ZSTD_LEVEL']).compressobj()
+    # wbits=31 makes zlib write a gzip header and trailer
+    return zlib.compressobj(config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+
+
+def _compress(body, encoding):
+    compressor = _compressor(encoding)
+    return compressor.compress(body) + compressor.flush()
+
+
+def _stream(chunks, encoding):
+    # Build the compressor now, the generator runs outside the app context
+    compressor = _compressor(encoding)
+
+    def generate():
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    return generate()
+
+
+def _chunks(body, size):
+    view = memoryview(body)
+    for start in range(0, len(view), size):
+        yield view[start:start + size]
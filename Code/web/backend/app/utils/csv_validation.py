@@ -1,3 +1,6 @@
+import csv
+
+
 def validate_csv_factors(uploaded_factors, space_factors):
     """Validate CSV columns match space's factor definition"""
     if len(uploaded_factors) != len(space_factors):
@@ -6,3 +9,16 @@ def validate_csv_factors(uploaded_factors, space_factors):
 
     if set(uploaded_factors) != set(space_factors):
         raise ValueError("Factor names don't match space definition")
+
+
+def read_csv_header(stream):
+    """Read and parse only the header line of a binary CSV stream"""
+    line = stream.readline()
+    if not line.strip():
+        raise ValueError("CSV file is empty")
+
+    try:
+        text = line.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ValueError("CSV header is not valid UTF-8")
+    return [name.strip() for name in next(csv.reader([text]))], line
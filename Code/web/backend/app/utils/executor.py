@@ -0,0 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from flask import current_app
+
+
+def init_executors(app):
+    """Create the shared pools views hand their blocking work to"""
+    if app.config['CPU_EXECUTOR'] == 'process':
+        cpu = ProcessPoolExecutor(max_workers=app.config['CPU_WORKERS'])
+    else:
+        cpu = ThreadPoolExecutor(max_workers=app.config['CPU_WORKERS'],
+                                 thread_name_prefix='cpu')
+
+    app.extensions['executors'] = {
+        'io': ThreadPoolExecutor(max_workers=app.config['IO_WORKERS'],
+                                 thread_name_prefix='io'),
+        'cpu': cpu
+    }
+
+
+def submit_io(fn, *args, **kwargs):
+    """Start blocking file I/O on the I/O pool, e.g. to read several
+    houses at once; returns a Future"""
+    return current_app.extensions['executors']['io'].submit(fn, *args, **kwargs)
+
+
+def run_io(fn, *args, **kwargs):
+    """Run blocking file I/O on the I/O pool and wait for its result"""
+    return submit_io(fn, *args, **kwargs).result()
+
+
+def run_cpu(fn, *args, **kwargs):
+    """Run a CPU-bound engine call on the compute pool and wait for it.
+
+    With CPU_EXECUTOR = 'process' the function and its arguments must be
+    picklable, so pass module-level functions and plain data.
+    """
+    return current_app.extensions['executors']['cpu'].submit(fn, *args, **kwargs).result()
@@ -0,0 +1,513 @@
+import contextlib
+import io
+import itertools
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from .csv_validation import read_csv_header, validate_csv_factors
+from .sorted_index import (build_sorted_index, column_quantiles, index_path_for,
+                           index_quantiles, merge_sorted_index)
+from .quantization import (decode, encode, encoding_errors, merge_errors,
+                           representable, storage_params, storage_range)
+from .statistics import RunningMoments
+
+
+def matrix_path_for(csv_path):
+    """Binary matrix file stored next to a house's CSV"""
+    return os.path.splitext(csv_path)[0] + '.npy'
+
+
+def ingest_csv(stream, csv_path, space_factors, chunk_rows=100_000,
+               quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), storage='float64',
+               index=False, keep_csv=False):
+    """Validate, store, convert and summarize an uploaded house CSV.
+
+    The header is checked against the space's factors before anything is
+    written. Rows are then parsed as floats chunk by chunk and appended to
+    the house's .npy matrix, so memory stays bounded by `chunk_rows`; with
+    `keep_csv` the raw bytes are also copied to `csv_path`. Per-factor
+    moments are accumulated along the way and the parsed values are
+    sorted one column at a time for the quantiles, so the summary is
+    exact. With `index` the matrix is also sorted into the house's sorted
+    index. Raises ValueError on a bad header or row, a row with the wrong
+    number of fields or a file without rows; on any error no files are
+    left behind.
+
+    With a `storage` other than float64 the matrix is quantized block by
+    block (see quantization.py). It is then the house's only copy of the
+    values unless the CSV is kept, and the index holds the same encoded
+    values.
+
+    Returns the House fields describing the stored data; the file_path
+    is None unless the CSV was kept.
+    """
+    columns, header = read_csv_header(stream)
+    validate_csv_factors(columns, space_factors)
+
+    matrix_path = matrix_path_for(csv_path)
+    # Work on temporary files so a rejected upload never clobbers the
+    # files of an existing house with the same name
+    csv_part = csv_path + '.part'
+    raw_part = matrix_path + '.raw'
+    matrix_part = matrix_path + '.part'
+    rows = 0
+    moments = RunningMoments(len(columns))
+    try:
+        with open(raw_part, 'wb') as raw, \
+                (open(csv_part, 'wb') if keep_csv else contextlib.nullcontext()) as csv_file:
+            if csv_file is not None:
+                csv_file.write(header)
+            reader = pd.read_csv(_CheckedReader(stream, len(columns), csv_file),
+                                 header=None, names=columns, index_col=False,
+                                 on_bad_lines='error', dtype=np.float64,
+                                 chunksize=chunk_rows)
+            for chunk in reader:
+                values = chunk.to_numpy(dtype=np.float64)
+                values.tofile(raw)
+                moments.update(values)
+                rows += len(chunk)
+        if rows == 0:
+            raise ValueError("CSV file has no simulation rows")
+
+        values = _raw_matrix(raw_part, rows, len(columns))
+        matrix_storage = None
+        if storage == 'float64':
+            _write_npy(raw_part, matrix_part, (rows, len(columns)))
+        else:
+            matrix_storage = _write_encoded(
+                _blocks(values, chunk_rows), matrix_part, values.shape,
+                storage_params(storage, moments.min, moments.max))
+        if keep_csv:
+            os.replace(csv_part, csv_path)
+        os.replace(matrix_part, matrix_path)
+
+        quantile_values = column_quantiles(
+            (values[:, c] for c in range(len(columns))), columns, list(quantiles))
+        del values
+
+        index_path = None
+        if index:
+            index_path = index_path_for(csv_path)
+            build_sorted_index(np.load(matrix_path, mmap_mode='r'), index_path)
+    except BaseException as e:
+        # Whatever failed, no file of the house is left behind
+        for path in (csv_path, matrix_path, index_path_for(csv_path)):
+            if os.path.exists(path):
+                os.remove(path)
+        if isinstance(e, (ValueError, pd.errors.ParserError)):
+            raise ValueError(f"Invalid simulation data: {e}")
+        raise
+    finally:
+        for path in (csv_part, raw_part, matrix_part):
+            if os.path.exists(path):
+                os.remove(path)
+
+    summary = moments.to_summary(columns, quantile_values)
+    return {
+        'file_path': csv_path if keep_csv else None,
+        'simulations_count': rows,
+        'factors_count': len(columns),
+        'matrix_path': matrix_path,
+        'matrix_columns': columns,
+        'matrix_storage': matrix_storage,
+        'index_path': index_path,
+        'summary': summary
+    }
+
+
+def append_csv(stream, csv_path, matrix_path, columns, chunk_rows=100_000,
+               index_path=None, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95),
+               storage=None):
+    """Append the rows of an uploaded CSV to a house's .npy matrix, and to
+    its CSV if one was kept.
+
+    The upload needs a header with the house's factors, in any order; rows
+    are written in the house's `columns` order. New rows are parsed and
+    staged chunk by chunk, then added to the end of the existing files, so
+    the old rows are never parsed again. When the house has a sorted index,
+    the new rows are merged into it and quantiles are read from the
+    result; without one they would need every column sorted again, so
+    none are returned. The CSV gets the new rows last, once the matrix
+    and index have them, and is cut back to its old length if that
+    fails. Raises ValueError on a bad header or row, a row with the wrong
+    number of fields or an upload without rows, leaving the house
+    untouched.
+
+    A quantized matrix (`storage`, see quantization.py) gets the new rows
+    encoded with its parameters. Only if they fall outside the range those
+    parameters cover is the matrix encoded again, from the CSV or without
+    one from its decoded values, and its index rebuilt.
+
+    Returns (added_rows, moments, quantiles, storage) where moments covers
+    the new rows only, quantiles is None without an index and
+    storage has the matrix's updated parameters and errors.
+    """
+    upload_columns, _ = read_csv_header(stream)
+    validate_csv_factors(upload_columns, columns)
+
+    # Houses converted without keeping their CSV have no csv_path
+    base = matrix_path or csv_path
+    csv_part = base + '.append'
+    raw_part = base + '.raw'
+    encoded_part = base + '.encoded'
+    keep_csv = csv_path is not None and os.path.exists(csv_path)
+    rows = 0
+    moments = RunningMoments(len(columns))
+    try:
+        with open(raw_part, 'wb') as raw, \
+                (open(csv_part, 'w', newline='') if keep_csv
+                 else contextlib.nullcontext()) as csv_file:
+            reader = pd.read_csv(_CheckedReader(stream, len(upload_columns)),
+                                 header=None, names=upload_columns, index_col=False,
+                                 on_bad_lines='error', dtype=np.float64,
+                                 chunksize=chunk_rows)
+            for chunk in reader:
+                chunk = chunk[columns]
+                values = chunk.to_numpy(dtype=np.float64)
+                values.tofile(raw)
+                if csv_file is not None:
+                    chunk.to_csv(csv_file, header=False, index=False)
+                moments.update(values)
+                rows += len(chunk)
+        if rows == 0:
+            raise ValueError("CSV file has no simulation rows")
+
+        values = _raw_matrix(raw_part, rows, len(columns))
+        # The index holds values as the matrix stores them
+        index_values = values
+        reencoded = False
+        if matrix_path and os.path.exists(matrix_path):
+            if storage is None:
+                _append_npy(raw_part, matrix_path, rows)
+            elif representable(values, storage):
+                index_values = encode(values, storage)
+                index_values.tofile(encoded_part)
+                storage = merge_errors(storage, *encoding_errors(
+                    values, index_values, storage))
+                _append_npy(encoded_part, matrix_path, rows)
+            else:
+                storage = _reencode(csv_path if keep_csv else None, matrix_path,
+                                    columns, storage, moments, values, chunk_rows)
+                reencoded = True
+        if index_path and os.path.exists(index_path):
+            if reencoded:
+                build_sorted_index(np.load(matrix_path, mmap_mode='r'), index_path)
+            else:
+                merge_sorted_index(index_path, index_values)
+        del values, index_values
+        if keep_csv:
+            _append_file(csv_part, csv_path)
+    except (ValueError, pd.errors.ParserError) as e:
+        raise ValueError(f"Invalid simulation data: {e}")
+    finally:
+        for path in (csv_part, raw_part, encoded_part):
+            if os.path.exists(path):
+                os.remove(path)
+
+    if index_path and os.path.exists(index_path):
+        quantiles = index_quantiles(index_path, columns, list(quantiles), storage)
+    else:
+        quantiles = None
+    return rows, moments, quantiles, storage
+
+
+def load_house(house, factors=None, runs=None):
+    """Simulation DataFrame of a house, memory-mapped when a matrix exists.
+
+    `factors` restricts the columns and `runs` = (start, stop) the rows
+    that are read; a stop of None reads to the end. CSVs are parsed with
+    usecols/skiprows/nrows so the rest of the file is never converted.
+    Quantized matrices are decoded for the selected rows and columns only.
+    """
+    start, stop = runs or (0, None)
+    if house.matrix_path and os.path.exists(house.matrix_path):
+        matrix = np.load(house.matrix_path, mmap_mode='r')[start:stop]
+        if factors is None:
+            return pd.DataFrame(decode(matrix, house.matrix_storage),
+                                columns=house.matrix_columns, copy=False)
+        order = [house.matrix_columns.index(factor) for factor in factors]
+        return pd.DataFrame(decode(matrix[:, order], house.matrix_storage, order),
+                            columns=factors)
+
+    nrows = None if stop is None else max(0, stop - start)
+    df = pd.read_csv(_kept_csv(house.file_path, house.id), usecols=factors,
+                     skiprows=range(1, start + 1), nrows=nrows)
+    return df if factors is None else df[factors]
+
+
+def house_source(house):
+    """Plain description of where a house's data lives, safe to pass to workers"""
+    return {
+        'id': house.id,
+        'file_path': house.file_path,
+        'matrix_path': house.matrix_path,
+        'columns': house.matrix_columns,
+        'storage': house.matrix_storage,
+        'runs': house.simulations_count
+    }
+
+
+def load_rows(source, factors, rows):
+    """Rows at the sorted indices `rows` of a house_source, as a
+    runs x factors float64 array. Only the pages holding those rows are
+    read from a matrix; a CSV is parsed in full."""
+    if source['matrix_path'] and os.path.exists(source['matrix_path']):
+        matrix = np.load(source['matrix_path'], mmap_mode='r')
+        order = [source['columns'].index(factor) for factor in factors]
+        return decode(matrix[rows][:, order], source['storage'], order)
+
+    df = pd.read_csv(_kept_csv(source['file_path'], source['id']), usecols=factors)
+    return df[factors].to_numpy(dtype=np.float64)[rows]
+
+
+def load_column(source, factor, runs=None):
+    """One factor of a house_source as a float64 array, rows `runs` = (start, stop)"""
+    start, stop = runs or (0, None)
+    if source['matrix_path'] and os.path.exists(source['matrix_path']):
+        matrix = np.load(source['matrix_path'], mmap_mode='r')
+        column = source['columns'].index(factor)
+        return np.array(decode(matrix[start:stop, [column]], source['storage'],
+                               [column])[:, 0])
+
+    nrows = None if stop is None else max(0, stop - start)
+    return pd.read_csv(_kept_csv(source['file_path'], source['id']), usecols=[factor],
+                       skiprows=range(1, start + 1),
+                       nrows=nrows)[factor].to_numpy(dtype=np.float64)
+
+
+def iter_row_blocks(sources, factors, block_rows, runs=None):
+    """Read houses in lockstep, `block_rows` runs at a time.
+
+    `runs` = (start, stop) limits the rows read, like for load_house.
+
+    Yields one list per block with a runs x factors float64 array for each
+    house, columns in `factors` order. Every house's block k covers the same
+    run range, so blocks stay aligned for paired comparisons; houses that
+    have run out of rows yield shorter (eventually empty) arrays until the
+    longest house is exhausted. Only one block per house is held in memory.
+    """
+    start, stop = runs or (0, None)
+    readers = [_block_reader(source, factors, block_rows, start, stop)
+               for source in sources]
+    while True:
+        blocks = [next(reader, None) for reader in readers]
+        if all(block is None for block in blocks):
+            return
+        yield [np.empty((0, len(factors))) if block is None else block
+               for block in blocks]
+
+
+def _block_reader(source, factors, block_rows, start, stop):
+    if source['matrix_path'] and os.path.exists(source['matrix_path']):
+        matrix = np.load(source['matrix_path'], mmap_mode='r')[start:stop]
+        order = [source['columns'].index(factor) for factor in factors]
+        # Quantized blocks are decoded one at a time, as they are read
+        for offset in range(0, matrix.shape[0], block_rows):
+            yield decode(matrix[offset:offset + block_rows][:, order],
+                         source['storage'], order)
+    else:
+        nrows = None if stop is None else max(0, stop - start)
+        if nrows == 0:
+            return
+        for chunk in pd.read_csv(_kept_csv(source['file_path'], source['id']),
+                                 usecols=factors,
+                                 skiprows=range(1, start + 1), nrows=nrows,
+                                 chunksize=block_rows):
+            yield chunk[factors].to_numpy(dtype=np.float64)
+
+
+def _kept_csv(csv_path, house_id):
+    # Houses fall back to their CSV only when they have no matrix, which
+    # never happens for houses that were stored without one
+    if csv_path is None or not os.path.exists(csv_path):
+        raise ValueError(f'House {house_id} has neither a matrix nor a CSV')
+    return csv_path
+
+
+class _CheckedReader:
+    """File-like wrapper that checks every line of `stream` has `n_fields`
+    comma-separated fields, optionally copying what is read to `sink`.
+
+    pandas fills short rows with NaN and can take an extra leading field as
+    the index, so the field count is checked here, on the raw bytes.
+    Blank lines are skipped, as pandas does.
+    """
+
+    def __init__(self, stream, n_fields, sink=None, first_line=2):
+        self.stream = stream
+        self.n_fields = n_fields
+        self.sink = sink
+        self.line = first_line
+        self.partial = b''
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if self.sink is not None:
+            self.sink.write(data)
+        if data:
+            lines = self.partial + data
+            end = lines.rfind(b'\n') + 1
+            self.partial = lines[end:]
+            self._check(lines[:end])
+        elif self.partial:
+            self._check(self.partial + b'\n')
+            self.partial = b''
+        return data
+
+    def _check(self, lines):
+        if not lines:
+            return
+        buffer = np.frombuffer(lines, dtype=np.uint8)
+        newlines = np.flatnonzero(buffer == ord('\n'))
+        commas = np.diff(np.cumsum(buffer == ord(','))[newlines], prepend=0)
+        starts = np.r_[0, newlines[:-1] + 1]
+        lengths = newlines - starts
+        blank = (lengths == 0) | ((lengths == 1) & (buffer[starts] == ord('\r')))
+        bad = np.flatnonzero((commas != self.n_fields - 1) & ~blank)
+        if len(bad):
+            raise ValueError(
+                f"Line {self.line + bad[0]} has {commas[bad[0]] + 1} fields, "
+                f"expected {self.n_fields}")
+        self.line += len(newlines)
+
+    def __iter__(self):
+        return self
+
+
+def _write_npy(raw_path, matrix_path, shape):
+    # Prepend an .npy header to the raw float64 rows without loading them
+    with open(matrix_path, 'wb') as out, open(raw_path, 'rb') as raw:
+        np.lib.format.write_array_header_1_0(out, {
+            'descr': np.lib.format.dtype_to_descr(np.dtype(np.float64)),
+            'fortran_order': False,
+            'shape': shape
+        })
+        shutil.copyfileobj(raw, out, 1024 * 1024)
+
+
+def _raw_matrix(raw_path, rows, n_columns):
+    # Memory-mapped view of staged float64 rows (an empty file can't be mapped)
+    if rows == 0:
+        return np.empty((0, n_columns))
+    return np.memmap(raw_path, dtype=np.float64, mode='r', shape=(rows, n_columns))
+
+
+def _blocks(values, block_rows):
+    for offset in range(0, len(values), block_rows):
+        yield np.asarray(values[offset:offset + block_rows], dtype=np.float64)
+
+
+def _write_encoded(blocks, matrix_path, shape, storage):
+    # Quantize float64 row blocks into an .npy file, recording the largest
+    # errors per column in the returned storage parameters
+    storage = merge_errors(storage, np.zeros(shape[1]), np.zeros(shape[1]))
+    with open(matrix_path, 'wb') as out:
+        np.lib.format.write_array_header_1_0(out, {
+            'descr': np.lib.format.dtype_to_descr(np.dtype(storage['dtype'])),
+            'fortran_order': False,
+            'shape': tuple(shape)
+        })
+        for block in blocks:
+            encoded = encode(block, storage)
+            out.write(encoded.tobytes())
+            storage = merge_errors(storage, *encoding_errors(block, encoded, storage))
+    return storage
+
+
+def _reencode(csv_path, matrix_path, columns, storage, moments, values,
+              chunk_rows):
+    # New rows beyond the range of the current parameters: widen the range
+    # and encode the whole house again, from its exact CSV values when it
+    # was kept, otherwise from the decoded matrix, followed by the new rows
+    lows, highs = storage_range(storage)
+    widened = storage_params(storage['dtype'], np.fmin(lows, moments.min),
+                             np.fmax(highs, moments.max))
+    old = np.load(matrix_path, mmap_mode='r')
+    shape = (old.shape[0] + len(values), len(columns))
+    if csv_path is not None:
+        reader = pd.read_csv(csv_path, usecols=columns, dtype=np.float64,
+                             chunksize=chunk_rows)
+        blocks = itertools.chain(
+            (chunk[columns].to_numpy(dtype=np.float64) for chunk in reader),
+            _blocks(values, chunk_rows))
+    else:
+        blocks = itertools.chain(
+            (decode(old[offset:offset + chunk_rows], storage)
+             for offset in range(0, old.shape[0], chunk_rows)),
+            _blocks(values, chunk_rows))
+    part = matrix_path + '.part'
+    try:
+        widened = _write_encoded(blocks, part, shape, widened)
+        del old, blocks
+        os.replace(part, matrix_path)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+    if csv_path is None:
+        # Old rows were measured against their decoded values, so their
+        # earlier errors add up with the new ones
+        widened['max_absolute_error'] = (np.asarray(widened['max_absolute_error'])
+                                         + storage['max_absolute_error']).tolist()
+        widened['max_relative_error'] = (np.asarray(widened['max_relative_error'])
+                                         + storage['max_relative_error']).tolist()
+    return widened
+
+
+def _append_file(part_path, path):
+    with open(path, 'rb+') as out, open(part_path, 'rb') as part:
+        # Make sure the new rows don't continue the last line
+        size = out.seek(0, os.SEEK_END)
+        try:
+            if size:
+                out.seek(-1, os.SEEK_END)
+                if out.read(1) not in (b'\n', b'\r'):
+                    out.write(b'\n')
+            shutil.copyfileobj(part, out, 1024 * 1024)
+        except BaseException:
+            # Leave the file as it was rather than with part of the rows
+            out.truncate(size)
+            raise
+
+
+def _append_npy(raw_path, matrix_path, added_rows):
+    # Grow the matrix in place: append the raw rows, then rewrite the
+    # header with the new row count. Headers are padded to a multiple of
+    # 64 bytes, so the new one almost always fits; otherwise the file is
+    # rebuilt once.
+    with open(matrix_path, 'rb+') as out:
+        version = np.lib.format.read_magic(out)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(out)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(out)
+        data_offset = out.tell()
+        new_shape = (shape[0] + added_rows,) + tuple(shape[1:])
+
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {
+            'descr': np.lib.format.dtype_to_descr(dtype),
+            'fortran_order': fortran_order,
+            'shape': new_shape
+        })
+        if version == (1, 0) and len(header.getvalue()) == data_offset:
+            out.seek(0, os.SEEK_END)
+            with open(raw_path, 'rb') as raw:
+                shutil.copyfileobj(raw, out, 1024 * 1024)
+            out.seek(0)
+            out.write(header.getvalue())
+            return
+
+    rebuilt = matrix_path + '.part'
+    try:
+        with open(rebuilt, 'wb') as out:
+            out.write(header.getvalue())
+            with open(matrix_path, 'rb') as old:
+                old.seek(data_offset)
+                shutil.copyfileobj(old, out, 1024 * 1024)
+            with open(raw_path, 'rb') as raw:
+                shutil.copyfileobj(raw, out, 1024 * 1024)
+        os.replace(rebuilt, matrix_path)
+    finally:
+        if os.path.exists(rebuilt):
+            os.remove(rebuilt)
@@ -0,0 +1,94 @@
+import json
+import math
+import numpy as np
+import pandas as pd
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+
+class NumpyJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes numpy and pandas objects directly.
+
+    numpy arrays and scalars, DataFrames and Series can be passed to
+    jsonify as they are. NaN and infinite values are written as null.
+    """
+
+    def dumps(self, obj, **kwargs):
+        # orjson has no indent or separators: honour them with the stdlib
+        if kwargs:
+            kwargs.setdefault('default', _std_default)
+            kwargs.setdefault('allow_nan', False)
+            return json.dumps(_finite(obj), **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def dumps_bytes(self, obj):
+        if orjson is not None:
+            option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=_orjson_default, option=option)
+
+        return json.dumps(_finite(obj), default=_std_default,
+                          sort_keys=self.sort_keys,
+                          allow_nan=False).encode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                # The stdlib also takes NaN and Infinity, as json.dumps writes them
+                pass
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def _pandas_records(obj):
+    """DataFrame rows as {column: value} records and Series as {index: value},
+    with the full float64 values (pandas' to_json rounds them)"""
+    if isinstance(obj, pd.DataFrame):
+        columns = obj.columns.tolist()
+        return [dict(zip(columns, row)) for row in obj.to_numpy().tolist()]
+    return dict(zip(obj.index.tolist(), obj.to_numpy().tolist()))
+
+
+def _orjson_default(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return _pandas_records(obj)
+    if isinstance(obj, np.ndarray):
+        # Non-contiguous or exotic dtypes orjson can't take natively
+        if obj.dtype.kind == 'f':
+            return np.ascontiguousarray(obj, dtype=np.float64)
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return DefaultJSONProvider.default(obj)
+
+
+def _std_default(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return _finite(_pandas_records(obj))
+    if isinstance(obj, np.ndarray):
+        return _finite(obj.tolist())
+    if isinstance(obj, np.generic):
+        return _finite(obj.item())
+    return DefaultJSONProvider.default(obj)
+
+
+def _finite(obj):
+    """Replace NaN and infinities with None for the standard library encoder"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    return obj
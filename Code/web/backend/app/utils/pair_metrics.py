@@ -0,0 +1,121 @@
+import numpy as np
+from .comparison import pair_indices
+
+DRD_QUANTILES = (0.025, 0.25, 0.5, 0.75, 0.975)
+
+
+def paired_metrics(stack, metrics, max_bytes=256 * 1024 * 1024,
+                   drd_threshold=0.05):
+    """SMD, DRD and discernibility for every pair i < j in one pass.
+
+    `stack` is houses x runs x factors (see stack_houses). The run-wise
+    differences of a block of pairs are computed once and shared by every
+    requested metric; blocks are sized so their temporaries stay within
+    `max_bytes`. Returns pairs x factors arrays ordered like pair_indices:
+    'smd' (mean / sample std of the differences, 0 when the std is 0),
+    'discernability' (runs where house i is lower) and 'drd', a summary
+    of the relative differences (a1 - a2) / max(a1, a2): mean, min, max,
+    DRD_QUANTILES, share below zero and share within +/- drd_threshold.
+    """
+    n_houses, n_runs, n_factors = stack.shape
+    rows, cols = pair_indices(n_houses)
+    n_pairs = len(rows)
+
+    results = {}
+    if 'smd' in metrics:
+        results['smd'] = np.empty((n_pairs, n_factors))
+    if 'discernability' in metrics:
+        results['discernability'] = np.empty((n_pairs, n_factors), dtype=np.int64)
+    if 'drd' in metrics:
+        results['drd'] = {key: np.empty((n_pairs, n_factors))
+                          for key in ('mean', 'min', 'max', 'below_zero', 'indifferent')}
+        results['drd']['quantiles'] = np.empty((len(DRD_QUANTILES), n_pairs, n_factors))
+    if not results or n_runs == 0:
+        return results
+
+    # Two pair slices plus differences, maxima and ratios per block
+    pair_block = max(1, max_bytes // (n_runs * n_factors * 8 * 6))
+    for p0 in range(0, n_pairs, pair_block):
+        p1 = min(p0 + pair_block, n_pairs)
+        a = stack[rows[p0:p1]]
+        b = stack[cols[p0:p1]]
+
+        if 'discernability' in results:
+            results['discernability'][p0:p1] = np.count_nonzero(a < b, axis=1)
+
+        diff = a - b
+        if 'smd' in results:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = diff.mean(axis=1)
+                std = diff.std(axis=1, ddof=1)
+                results['smd'][p0:p1] = np.where(std != 0, mean / std, 0.0)
+
+        if 'drd' in results:
+            maximum = np.maximum(a, b)
+            drd = np.zeros_like(diff)
+            np.divide(diff, maximum, out=drd, where=maximum != 0)
+            summary = results['drd']
+            summary['mean'][p0:p1] = drd.mean(axis=1)
+            summary['min'][p0:p1] = drd.min(axis=1)
+            summary['max'][p0:p1] = drd.max(axis=1)
+            summary['quantiles'][:, p0:p1] = np.quantile(drd, DRD_QUANTILES, axis=1)
+            summary['below_zero'][p0:p1] = (drd < 0).mean(axis=1)
+            summary['indifferent'][p0:p1] = (np.abs(drd) <= drd_threshold).mean(axis=1)
+    return results
+
+
+def k4_metric(means, lamb):
+    """K4 for every pair i < j from houses x factors means.
+
+    Mean differences are scaled by the largest absolute difference of the
+    pair, and values with |v| <= lamb are set to 0.
+    """
+    rows, cols = pair_indices(len(means))
+    diffs = means[rows] - means[cols]
+    largest = np.abs(diffs).max(axis=1, keepdims=True) if diffs.size else diffs
+    normalized = diffs / np.where(largest != 0, largest, 1)
+    return np.where(np.abs(normalized) > lamb, normalized, 0.0)
+
+
+def ranking_counts(stack, max_bytes=256 * 1024 * 1024):
+    """How often each ordering of the houses occurs, per factor.
+
+    Houses are argsorted run by run, lowest value first. Returns one
+    {ordering: count} dict per factor, where an ordering is a tuple of
+    house positions in `stack`.
+    """
+    n_houses, n_runs, n_factors = stack.shape
+    counts = [{} for _ in range(n_factors)]
+
+    run_block = max(1, max_bytes // max(1, n_houses * n_factors * 16))
+    for r0 in range(0, n_runs, run_block):
+        order = np.argsort(stack[:, r0:r0 + run_block], axis=0, kind='stable')
+        for f in range(n_factors):
+            orderings, frequencies = np.unique(order[:, :, f].T, axis=0,
+                                               return_counts=True)
+            for ordering, count in zip(map(tuple, orderings.tolist()),
+                                       frequencies.tolist()):
+                counts[f][ordering] = counts[f].get(ordering, 0) + count
+    return counts
+
+
+def rank_counts(stack, max_bytes=256 * 1024 * 1024):
+    """How often each house takes each rank, per factor.
+
+    Houses are argsorted run by run (rank 0 is the lowest value) for a
+    block of runs at a time. Returns a factors x houses x ranks int64
+    array; dividing by the run count gives the marginal rank probabilities.
+    """
+    n_houses, n_runs, n_factors = stack.shape
+    counts = np.zeros(n_factors * n_houses * n_houses, dtype=np.int64)
+    ranks = np.arange(n_houses)[:, None, None]
+    factor_offsets = np.arange(n_factors) * n_houses
+
+    # The sorted order, the flat indices and a copy of the values per run
+    run_block = max(1, max_bytes // max(1, n_houses * n_factors * 24))
+    for r0 in range(0, n_runs, run_block):
+        order = np.argsort(stack[:, r0:r0 + run_block], axis=0, kind='stable')
+        # order[r, run, f] is the house at rank r: count (f, house, r)
+        flat = ((factor_offsets + order) * n_houses + ranks).ravel()
+        counts += np.bincount(flat, minlength=counts.size)
+    return counts.reshape(n_factors, n_houses, n_houses)
@@ -0,0 +1,158 @@
+import numpy as np
+
+# Matrix storage tiers, from exact to smallest (8, 4, 2, 2 and 1 bytes a value)
+STORAGE_DTYPES = ('float64', 'float32', 'float16', 'int16', 'int8')
+
+
+def storage_params(dtype, minimums, maximums):
+    """Per-column offset and scale used to store float64 values as `dtype`.
+
+    A stored value v stands for v * scale + offset. float32 keeps the
+    values as they are. float16 divides each column by a power of two so
+    that its largest magnitude stays well within range. Integers map each
+    column's [min, max] linearly onto the type's range, keeping the lowest
+    integer free to mark NaN.
+    """
+    minimums = np.nan_to_num(np.asarray(minimums, dtype=np.float64))
+    maximums = np.nan_to_num(np.asarray(maximums, dtype=np.float64))
+    offset = np.zeros(len(minimums))
+    scale = np.ones(len(minimums))
+
+    if dtype == 'float16':
+        largest = np.maximum(np.abs(minimums), np.abs(maximums))
+        exponent = np.where(largest > 0,
+                            np.ceil(np.log2(np.where(largest > 0, largest, 1))) - 15, 0)
+        scale = 2.0 ** exponent
+    elif dtype in ('int16', 'int8'):
+        info = np.iinfo(dtype)
+        steps = int(info.max) - (int(info.min) + 1)
+        offset = (minimums + maximums) / 2
+        scale = np.where(maximums > minimums, (maximums - minimums) / steps, 1.0)
+
+    return {'dtype': dtype, 'offset': offset.tolist(), 'scale': scale.tolist()}
+
+
+def encode(block, storage):
+    """Store a rows x columns float64 block in the storage's dtype"""
+    dtype = np.dtype(storage['dtype'])
+    scaled = (block - np.asarray(storage['offset'])) / np.asarray(storage['scale'])
+    if dtype.kind != 'i':
+        return scaled.astype(dtype)
+
+    info = np.iinfo(dtype)
+    missing = np.isnan(scaled)
+    encoded = np.clip(np.rint(np.where(missing, 0, scaled)), info.min + 1, info.max)
+    encoded[missing] = info.min
+    return encoded.astype(dtype)
+
+
+def decode(values, storage, columns=None):
+    """float64 values of stored rows; `columns` are the column indices the
+    rows were taken from (default: all, in order)"""
+    values = np.asarray(values)
+    if storage is None:
+        return np.asarray(values, dtype=np.float64)
+
+    offset = np.asarray(storage['offset'])
+    scale = np.asarray(storage['scale'])
+    if columns is not None:
+        offset, scale = offset[columns], scale[columns]
+    decoded = values.astype(np.float64)
+    if values.dtype.kind == 'i':
+        decoded[values == np.iinfo(values.dtype).min] = np.nan
+    decoded *= scale
+    decoded += offset
+    return decoded
+
+
+def storage_range(storage):
+    """Per-column lowest and highest values the parameters were made for"""
+    offset = np.asarray(storage['offset'])
+    scale = np.asarray(storage['scale'])
+    if storage['dtype'] == 'float32':
+        return np.full(len(offset), -np.inf), np.full(len(offset), np.inf)
+    if storage['dtype'] == 'float16':
+        half = scale * 2.0 ** 15
+    else:
+        info = np.iinfo(storage['dtype'])
+        half = scale * (int(info.max) - (int(info.min) + 1)) / 2
+    return offset - half, offset + half
+
+
+def representable(block, storage):
+    """Whether a block can be stored without clipping or overflowing"""
+    if storage['dtype'] == 'float32':
+        return True
+    scaled = (block - np.asarray(storage['offset'])) / np.asarray(storage['scale'])
+    scaled = scaled[~np.isnan(scaled)]
+    if storage['dtype'] == 'float16':
+        return bool(np.all(np.abs(scaled) <= np.finfo(np.float16).max))
+    info = np.iinfo(storage['dtype'])
+    # Half a step of slack for rounding
+    return bool(np.all((scaled >= info.min + 0.5) & (scaled <= info.max + 0.5)))
+
+
+def encoding_errors(block, encoded, storage):
+    """Per-column largest absolute and relative error of an encoded block.
+
+    Relative errors are taken over the non-zero values only.
+    """
+    decoded = decode(encoded, storage)
+    error = np.abs(decoded - block)
+    valid = ~np.isnan(block)
+    absolute = np.where(valid, error, 0.0).max(axis=0, initial=0.0)
+    nonzero = valid & (block != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = np.where(nonzero, error / np.abs(block), 0.0).max(axis=0, initial=0.0)
+    return absolute, relative
+
+
+def merge_errors(storage, absolute, relative):
+    """Storage parameters with the recorded maximum errors raised to cover
+    a newly encoded block"""
+    storage = dict(storage)
+    storage['max_absolute_error'] = np.maximum(
+        storage.get('max_absolute_error', 0.0), absolute).tolist()
+    storage['max_relative_error'] = np.maximum(
+        storage.get('max_relative_error', 0.0), relative).tolist()
+    return storage
+
+
+def storage_report(storage, columns, summary, factors=None, warn_fraction=0.01):
+    """dtype and largest decoding errors of a house matrix over `factors`
+    (default: all of its `columns`).
+
+    Relative errors are taken value by value, so they blow up for values
+    near zero: N(0, 1) data stored as int8 shows relative errors well above
+    1 while each value is off by a hundredth of the spread. The largest
+    absolute error is therefore also given as a fraction of each factor's
+    standard deviation from `summary`. When that reaches `warn_fraction`
+    for some factor, runs closer than the error may compare either way and
+    the report carries a warning.
+    """
+    if storage is None:
+        return {'dtype': 'float64', 'max_absolute_error': 0.0,
+                'max_relative_error': 0.0, 'max_error_to_std': 0.0}
+
+    factors = factors or columns
+    order = [columns.index(factor) for factor in factors]
+    absolute = np.asarray(storage['max_absolute_error'])[order]
+    relative = np.asarray(storage['max_relative_error'])[order]
+    std = np.array([np.sqrt(summary[f]['variance'])
+                    if summary and summary[f]['variance'] is not None else np.nan
+                    for f in factors])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        to_std = np.where(absolute > 0, absolute / std, 0.0)
+
+    report = {
+        'dtype': storage['dtype'],
+        'max_absolute_error': float(absolute.max(initial=0.0)),
+        'max_relative_error': float(relative.max(initial=0.0)),
+        'max_error_to_std': float(np.nanmax(to_std, initial=0.0))
+    }
+    noisy = [f for f, ratio in zip(factors, to_std) if not ratio < warn_fraction]
+    if noisy:
+        report['warning'] = (
+            f"{storage['dtype']} storage errors reach {warn_fraction:g} of the "
+            f"standard deviation of {', '.join(noisy)}")
+    return report
@@ -0,0 +1,176 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, jsonify, request
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+LANES = (INTERACTIVE, BATCH)
+
+
+class AdmissionScheduler:
+    """Bounded concurrency for compute routes with two priority lanes.
+
+    At most `max_concurrent` requests run at the same time, and batch
+    requests never hold more than `batch_max_concurrent` of those slots.
+    When a slot frees up, queued interactive requests are admitted before
+    queued batch requests. A request is rejected when its lane's queue is
+    full or when it has waited longer than `max_wait` seconds.
+    """
+
+    def __init__(self, max_concurrent, batch_max_concurrent, max_queue,
+                 max_wait):
+        self.max_concurrent = max_concurrent
+        self.batch_max_concurrent = min(batch_max_concurrent, max_concurrent)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._cond = threading.Condition()
+        self._queues = {lane: deque() for lane in LANES}
+        self._running = {lane: 0 for lane in LANES}
+        self._admitted = {lane: 0 for lane in LANES}
+        self._rejected = {lane: 0 for lane in LANES}
+        # Moving average of how long an admitted request holds its slot
+        self._service_time = 1.0
+
+    def acquire(self, lane):
+        """Wait for a slot in `lane`, return False if the request is rejected"""
+        with self._cond:
+            queue = self._queues[lane]
+            if not queue and self._has_slot(lane) \
+                    and (lane == INTERACTIVE or not self._queues[INTERACTIVE]):
+                self._admit(lane)
+                return True
+
+            if len(queue) >= self.max_queue[lane]:
+                self._rejected[lane] += 1
+                return False
+
+            ticket = object()
+            queue.append(ticket)
+            deadline = time.monotonic() + self.max_wait
+            while not (self._next_ticket() is ticket and self._has_slot(lane)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.remove(ticket)
+                    self._rejected[lane] += 1
+                    # Our departure may unblock the request queued behind us
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(remaining)
+
+            queue.popleft()
+            self._admit(lane)
+            self._cond.notify_all()
+            return True
+
+    def release(self, lane, elapsed):
+        with self._cond:
+            self._running[lane] -= 1
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+            self._cond.notify_all()
+
+    def retry_after(self):
+        """Seconds a rejected client should wait, from the current backlog"""
+        with self._cond:
+            backlog = sum(len(q) for q in self._queues.values()) + 1
+            return max(1, math.ceil(
+                self._service_time * backlog / self.max_concurrent))
+
+    def metrics(self):
+        with self._cond:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'batch_max_concurrent': self.batch_max_concurrent,
+                'running': dict(self._running),
+                'queued': {lane: len(q) for lane, q in self._queues.items()},
+                'admitted': dict(self._admitted),
+                'rejected': dict(self._rejected),
+                'avg_service_time': round(self._service_time, 4)
+            }
+
+    def _has_slot(self, lane):
+        if sum(self._running.values()) >= self.max_concurrent:
+            return False
+        if lane == BATCH:
+            return self._running[BATCH] < self.batch_max_concurrent
+        return True
+
+    def _next_ticket(self):
+        # Interactive requests always go first; a batch request that can't
+        # get a batch slot doesn't hold up the interactive lane
+        if self._queues[INTERACTIVE]:
+            return self._queues[INTERACTIVE][0]
+        if self._queues[BATCH]:
+            return self._queues[BATCH][0]
+        return None
+
+    def _admit(self, lane):
+        self._running[lane] += 1
+        self._admitted[lane] += 1
+
+
+def init_admission(app):
+    app.extensions['admission'] = AdmissionScheduler(
+        max_concurrent=app.config['ADMISSION_MAX_CONCURRENT'],
+        batch_max_concurrent=app.config['ADMISSION_BATCH_MAX_CONCURRENT'],
+        max_queue=app.config['ADMISSION_MAX_QUEUE'],
+        max_wait=app.config['ADMISSION_MAX_WAIT']
+    )
+
+
+class ServerBusy(Exception):
+    """Raised by admission_slot when the request is rejected"""
+
+
+@contextmanager
+def admission_slot(lane=INTERACTIVE):
+    """Hold an admission slot in the given lane for the `with` block.
+
+    Raises ServerBusy when the request is rejected; busy_response() is
+    the matching 429. Lets a view take a slot for part of its work only.
+    """
+    scheduler = current_app.extensions['admission']
+    request_lane = _request_lane(lane)
+    if not scheduler.acquire(request_lane):
+        raise ServerBusy()
+
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        scheduler.release(request_lane, time.monotonic() - start)
+
+
+def admit(lane=INTERACTIVE):
+    """Run the view under admission control in the given priority lane.
+
+    Clients can move an interactive request to the batch lane with an
+    `X-Priority: batch` header, but never the other way round.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                with admission_slot(lane):
+                    return view(*args, **kwargs)
+            except ServerBusy:
+                return busy_response()
+        return wrapper
+    return decorator
+
+
+def _request_lane(lane):
+    if request.headers.get('X-Priority') == BATCH:
+        return BATCH
+    return lane
+
+
+def busy_response():
+    """429 for a rejected request, with a Retry-After from the backlog"""
+    scheduler = current_app.extensions['admission']
+    return jsonify({'error': 'Server busy, retry later'}), 429, \
+        {'Retry-After': str(scheduler.retry_after())}
@@ -0,0 +1,66 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+
+
+def upgrade_schema(db):
+    """Add model columns and indexes that are missing from existing tables.
+
+    db.create_all() only creates tables that don't exist yet, so databases
+    created before a column or index was added keep their old layout. New
+    columns are nullable and get added in place; columns the model has
+    since made nullable lose their NOT NULL constraint.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column['name']: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+        relaxed = [column.name for column in table.columns
+                   if column.name in existing and column.nullable
+                   and not existing[column.name]['nullable']]
+        if relaxed:
+            _drop_not_null(db, table, relaxed)
+
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(bind=db.engine)
+
+
+def _drop_not_null(db, table, columns):
+    if db.engine.dialect.name != 'sqlite':
+        with db.engine.begin() as conn:
+            for column in columns:
+                conn.execute(text(
+                    f'ALTER TABLE {table.name} ALTER COLUMN {column} DROP NOT NULL'))
+        return
+
+    # SQLite can't change a column in place: copy the rows into a table
+    # created from the model, then swap it in. Foreign keys are off for
+    # the swap so tables referencing this one keep their rows.
+    names = ', '.join(column.name for column in table.columns)
+    create = str(CreateTable(table).compile(dialect=db.engine.dialect)).replace(
+        f'CREATE TABLE {table.name} ', f'CREATE TABLE {table.name}_upgrade ', 1)
+    with db.engine.connect() as conn:
+        conn.execute(text('PRAGMA foreign_keys=OFF'))
+        conn.commit()
+        try:
+            conn.execute(text(create))
+            conn.execute(text(
+                f'INSERT INTO {table.name}_upgrade ({names}) SELECT {names} FROM {table.name}'))
+            conn.execute(text(f'DROP TABLE {table.name}'))
+            conn.execute(text(f'ALTER TABLE {table.name}_upgrade RENAME TO {table.name}'))
+            conn.commit()
+        finally:
+            conn.rollback()
+            conn.execute(text('PRAGMA foreign_keys=ON'))
+            conn.commit()
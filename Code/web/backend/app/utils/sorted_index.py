@@ -0,0 +1,147 @@
+import os
+import numpy as np
+from .quantization import decode
+
+
+def index_path_for(csv_path):
+    """Sorted index file stored next to a house's CSV"""
+    return os.path.splitext(csv_path)[0] + '.sorted.npy'
+
+
+def build_sorted_index(matrix, index_path):
+    """Write a factors x runs copy of a runs x factors matrix, each factor
+    sorted ascending with its missing values at the end for floats and at
+    the start for quantized integers (their NaN marker is the lowest
+    integer).
+
+    The index keeps the matrix's dtype: a quantized matrix is indexed by
+    its encoded values, whose order is that of the decoded ones. Every
+    factor is a contiguous row, so a binary search on it only touches a
+    few pages of the memory-mapped file.
+    """
+    part = index_path + '.part'
+    try:
+        index = np.lib.format.open_memmap(
+            part, mode='w+', dtype=matrix.dtype, shape=matrix.shape[::-1])
+        for c in range(matrix.shape[1]):
+            index[c] = np.sort(np.asarray(matrix[:, c]))
+        index.flush()
+        del index
+        os.replace(part, index_path)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+
+
+def merge_sorted_index(index_path, values):
+    """Add the rows of a runs x factors array, in the index's dtype, to an
+    existing sorted index.
+
+    Each factor is merged in O(n + k): the new values are sorted and
+    inserted at their binary-search positions in the old row.
+    """
+    old = np.load(index_path, mmap_mode='r')
+    n_factors, n_runs = old.shape
+    missing = _missing_value(old.dtype)
+    part = index_path + '.part'
+    try:
+        index = np.lib.format.open_memmap(
+            part, mode='w+', dtype=old.dtype, shape=(n_factors, n_runs + len(values)))
+        for c in range(n_factors):
+            valid = np.asarray(valid_values(old[c]))
+            new_valid = valid_values(np.sort(values[:, c]))
+            merged = np.insert(valid, np.searchsorted(valid, new_valid, side='right'),
+                               new_valid)
+            if index.dtype.kind == 'i':
+                index[c, :index.shape[1] - len(merged)] = missing
+                index[c, index.shape[1] - len(merged):] = merged
+            else:
+                index[c, :len(merged)] = merged
+                index[c, len(merged):] = missing
+        index.flush()
+        del index, old
+        os.replace(part, index_path)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+
+
+def valid_values(row):
+    """The non-missing part of a sorted row, found by binary search"""
+    if row.dtype.kind == 'i':
+        return row[int(np.searchsorted(row, _missing_value(row.dtype), side='right')):]
+    return row[:int(np.searchsorted(row, np.nan, side='left'))]
+
+
+def _row_floor(dtype, targets):
+    # Largest value of `dtype` at most each float64 target, and whether it
+    # is the target itself, so the row is searched without being converted
+    if dtype.kind == 'i':
+        info = np.iinfo(dtype)
+        floor = np.clip(np.floor(targets), info.min, info.max)
+    else:
+        floor = targets.astype(dtype)
+        floor = np.where(floor > targets, np.nextafter(floor, dtype.type(-np.inf)), floor)
+    return floor.astype(dtype), floor == targets
+
+
+def _missing_value(dtype):
+    # What stands for NaN in an index row of this dtype
+    return np.iinfo(dtype).min if dtype.kind == 'i' else np.nan
+
+
+def sorted_quantiles(row, probabilities, storage=None, column=0):
+    """Quantiles of a sorted row with np.quantile's linear interpolation,
+    reading only the two neighbours of each position. The rows of a
+    quantized index are decoded with `storage` for their `column`."""
+    valid = valid_values(row)
+    n = len(valid)
+    if n == 0:
+        return [np.nan] * len(probabilities)
+    points = []
+    for p in probabilities:
+        position = (n - 1) * p
+        below = int(np.floor(position))
+        above = min(below + 1, n - 1)
+        low, high = decode(np.asarray(valid[[below, above]]), storage, [column])
+        points.append(float(low + (high - low) * (position - below)))
+    return points
+
+
+def index_quantiles(index_path, columns, probabilities, storage=None):
+    """{column: {str(p): value}} read from a sorted index"""
+    index = np.load(index_path, mmap_mode='r')
+    return {column: _quantile_values(
+                sorted_quantiles(index[c], probabilities, storage, c), probabilities)
+            for c, column in enumerate(columns)}
+
+
+def column_quantiles(values, columns, probabilities):
+    """{column: {str(p): value}} of houses without an index; `values`
+    yields each column's values in turn, so one column is sorted at a time"""
+    return {column: _quantile_values(sorted_quantiles(np.sort(row), probabilities),
+                                     probabilities)
+            for column, row in zip(columns, values)}
+
+
+def _quantile_values(points, probabilities):
+    # No NaN in the stored JSON
+    return {str(p): None if np.isnan(v) else v
+            for p, v in zip(probabilities, points)}
+
+
+def threshold_counts(row, thresholds, storage=None, column=0):
+    """Runs below and at most each threshold, with the resulting CDF value.
+    Thresholds are searched for in a quantized row as encoded values, the
+    encoding keeping the order of the decoded ones."""
+    valid = valid_values(row)
+    n = len(valid)
+    targets = np.asarray(thresholds, dtype=np.float64)
+    if storage is not None:
+        targets = (targets - storage['offset'][column]) / storage['scale'][column]
+    floor, exact = _row_floor(valid.dtype, targets)
+    at_most = np.searchsorted(valid, floor, side='right')
+    below = np.where(exact, np.searchsorted(valid, floor, side='left'), at_most)
+    return [{'threshold': threshold, 'below': int(b), 'at_most': int(a),
+             'cdf': int(a) / n if n else None}
+            for threshold, b, a in zip(thresholds, below, at_most)]
@@ -0,0 +1,20 @@
+from sqlalchemy import event
+
+
+def init_sqlite(app, db):
+    """Apply the configured PRAGMAs to every new SQLite connection.
+
+    WAL journaling lets readers keep going while an upload writes, and
+    busy_timeout makes writers wait for the lock instead of failing.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = app.config['SQLITE_PRAGMAS']
+
+    @event.listens_for(db.engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
@@ -0,0 +1,138 @@
+import numpy as np
+
+
+class RunningMoments:
+    """Per-column count, mean, variance, min and max, updated block by block.
+
+    Blocks are merged with Chan's parallel formula, so the result matches
+    a single pass over all rows without keeping them in memory. NaN values
+    are ignored, like pandas does.
+    """
+
+    def __init__(self, n_columns):
+        self.count = np.zeros(n_columns, dtype=np.int64)
+        self.mean = np.zeros(n_columns, dtype=np.float64)
+        self.m2 = np.zeros(n_columns, dtype=np.float64)
+        self.min = np.full(n_columns, np.nan)
+        self.max = np.full(n_columns, np.nan)
+
+    def update(self, block):
+        """Fold a rows x columns block into the running statistics"""
+        block = np.asarray(block, dtype=np.float64)
+        if block.shape[0] == 0:
+            return
+
+        valid = ~np.isnan(block)
+        count = valid.sum(axis=0)
+        total = np.where(valid, block, 0.0).sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(count > 0, total / count, 0.0)
+        m2 = np.where(valid, (block - mean) ** 2, 0.0).sum(axis=0)
+
+        self._merge(count, mean, m2)
+        self.min = np.fmin(self.min, np.fmin.reduce(block, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(block, axis=0))
+
+    def merge(self, other):
+        """Combine with the statistics of another, disjoint set of rows"""
+        self._merge(other.count, other.mean, other.m2)
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+
+    def variance(self, ddof=1):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan)
+
+    def _merge(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(total > 0, count / total, 0.0)
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * weight
+        self.count = total
+
+    @classmethod
+    def from_summary(cls, summary, columns):
+        """Rebuild the accumulator from a summary written by to_summary"""
+        moments = cls(len(columns))
+        for c, column in enumerate(columns):
+            stats = summary[column]
+            moments.count[c] = stats['count']
+            moments.mean[c] = _float(stats['mean'])
+            variance = _float(stats['variance'])
+            moments.m2[c] = 0.0 if np.isnan(variance) \
+                else variance * max(stats['count'] - 1, 0)
+            moments.min[c] = _float(stats['min'])
+            moments.max[c] = _float(stats['max'])
+        return moments
+
+    def to_summary(self, columns, quantiles=None):
+        """JSON-ready {column: {count, mean, variance, min, max, quantiles}}"""
+        variance = self.variance()
+        summary = {}
+        for c, column in enumerate(columns):
+            summary[column] = {
+                'count': int(self.count[c]),
+                'mean': _json_float(self.mean[c] if self.count[c] else np.nan),
+                'variance': _json_float(variance[c]),
+                'min': _json_float(self.min[c]),
+                'max': _json_float(self.max[c]),
+                'quantiles': None if quantiles is None else quantiles[column]
+            }
+        return summary
+
+
+def summary_arrays(summaries, columns):
+    """Stack house summaries into houses x columns count, mean and variance arrays"""
+    counts = np.array([[s[c]['count'] for c in columns] for s in summaries],
+                      dtype=np.int64)
+    means = np.array([[_float(s[c]['mean']) for c in columns] for s in summaries],
+                     dtype=np.float64)
+    variances = np.array([[_float(s[c]['variance']) for c in columns]
+                          for s in summaries], dtype=np.float64)
+    return counts, means, variances
+
+
+def summary_ranges(summaries, columns):
+    """Stack house summaries into houses x columns min and max arrays"""
+    minimums = np.array([[_float(s[c]['min']) for c in columns] for s in summaries],
+                        dtype=np.float64)
+    maximums = np.array([[_float(s[c]['max']) for c in columns] for s in summaries],
+                        dtype=np.float64)
+    return minimums, maximums
+
+
+def hoeffding_sample_size(tolerance, delta):
+    """Runs needed for a mean of [0, 1] values to be within +/- tolerance
+    of its expectation with probability 1 - delta (Hoeffding)"""
+    return int(np.ceil(np.log(2 / delta) / (2 * tolerance ** 2)))
+
+
+def hoeffding_bound(n, delta):
+    """+/- error guaranteed with probability 1 - delta for a mean of n [0, 1] values"""
+    return np.sqrt(np.log(2 / delta) / (2 * n)) if n else np.inf
+
+
+def empirical_bernstein_bound(p, n, delta):
+    """Variance-aware +/- error, with probability 1 - delta, for the mean p
+    of n values in {0, 1} (Maurer & Pontil's empirical Bernstein bound).
+
+    Much tighter than Hoeffding when p is close to 0 or 1.
+    """
+    p = np.asarray(p, dtype=np.float64)
+    if n < 2:
+        return np.full(p.shape, np.inf)
+    variance = p * (1 - p) * n / (n - 1)
+    log_term = np.log(4 / delta)
+    return np.sqrt(2 * variance * log_term / n) + 7 * log_term / (3 * (n - 1))
+
+
+def _json_float(value):
+    # The database stores JSON, which has no NaN
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def _float(value):
+    return np.nan if value is None else float(value)
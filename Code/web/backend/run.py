@@ -3,4 +3,5 @@ from app import create_app
 app = create_app()
 
 if __name__ == '__main__':
+    # Development server; wsgi.py serves the app with waitress
     app.run(debug=True)
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from app.utils.comparison import (bootstrap_less_probabilities, pair_indices,
+                                  pairwise_less_counts, unpaired_less_probabilities)
+
+
+def _brute_less_counts(stack):
+    rows, cols = pair_indices(len(stack))
+    return np.array([np.count_nonzero(stack[i] < stack[j], axis=0)
+                     for i, j in zip(rows, cols)]).reshape(len(rows), stack.shape[2])
+
+
+@pytest.mark.parametrize('n_houses', [2, 3, 6])
+@pytest.mark.parametrize('max_bytes', [1, 64, 256 * 1024 * 1024])
+def test_pairwise_less_counts_matches_brute_force(n_houses, max_bytes):
+    stack = np.random.default_rng(n_houses).normal(size=(n_houses, 101, 3))
+    counts = pairwise_less_counts(stack, max_bytes)
+    assert counts.dtype == np.int64
+    np.testing.assert_array_equal(counts, _brute_less_counts(stack))
+
+
+def test_pairwise_less_counts_ties_and_nan_are_not_less():
+    stack = np.array([[[1.0], [2.0], [np.nan]],
+                      [[1.0], [3.0], [0.0]]])
+    np.testing.assert_array_equal(pairwise_less_counts(stack), [[1]])
+
+
+def test_pairwise_less_counts_single_house():
+    assert pairwise_less_counts(np.zeros((1, 5, 2))).shape == (0, 2)
+
+
+def test_bootstrap_less_probabilities_shape_range_and_seed():
+    stack = np.random.default_rng(0).normal(size=(4, 200, 2))
+    replicates = bootstrap_less_probabilities(stack, 50, seed=7)
+    assert replicates.shape == (50, 6, 2)
+    assert ((replicates >= 0) & (replicates <= 1)).all()
+    np.testing.assert_array_equal(replicates,
+                                  bootstrap_less_probabilities(stack, 50, seed=7))
+    # Blocking over runs and replicates doesn't change the resampling
+    np.testing.assert_allclose(
+        replicates, bootstrap_less_probabilities(stack, 50, seed=7, max_bytes=1000))
+
+
+def test_bootstrap_less_probabilities_centres_on_the_point_estimate():
+    stack = np.random.default_rng(1).normal(size=(3, 500, 2))
+    point = pairwise_less_counts(stack) / 500
+    replicates = bootstrap_less_probabilities(stack, 400, seed=0)
+    np.testing.assert_allclose(replicates.mean(axis=0), point, atol=0.01)
+
+
+def test_bootstrap_less_probabilities_settled_pairs_stay_settled():
+    # House 0 is below house 1 on every run: every resample agrees
+    stack = np.stack([np.zeros((30, 1)), np.ones((30, 1))])
+    replicates = bootstrap_less_probabilities(stack, 20, seed=0)
+    np.testing.assert_array_equal(replicates, np.ones((20, 1, 1)))
+
+
+def test_unpaired_less_probabilities_matches_all_combinations():
+    rng = np.random.default_rng(2)
+    # Rounded so that some runs tie across houses
+    columns = [np.sort(np.round(rng.normal(size=n), 1)) for n in (40, 55, 23)]
+    rows, cols = pair_indices(len(columns))
+    expected = [np.mean(columns[i][:, None] < columns[j][None, :])
+                for i, j in zip(rows, cols)]
+    np.testing.assert_allclose(unpaired_less_probabilities(columns), expected)
+
+
+def test_unpaired_less_probabilities_empty_house_is_nan():
+    result = unpaired_less_probabilities([np.array([1.0, 2.0]), np.array([]),
+                                          np.array([3.0])])
+    assert np.isnan(result[0]) and np.isnan(result[2])
+    assert result[1] == 1.0
@@ -0,0 +1,58 @@
+import io
+
+import numpy as np
+import pytest
+
+from app.utils.house_data import _CheckedReader, ingest_csv
+
+
+def _read_all(reader, size):
+    data = b''
+    while True:
+        chunk = reader.read(size)
+        if not chunk:
+            return data
+        data += chunk
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, -1])
+def test_checked_reader_passes_good_rows_in_any_read_size(size):
+    body = b'1,2,3\r\n4,5,6\n\n7,8,9'
+    sink = io.BytesIO()
+    assert _read_all(_CheckedReader(io.BytesIO(body), 3, sink), size) == body
+    assert sink.getvalue() == body
+
+
+@pytest.mark.parametrize('size', [1, 4, -1])
+@pytest.mark.parametrize('body, line, fields', [
+    (b'1,2,3\n4,5\n7,8,9\n', 3, 2),
+    (b'1,2,3\n4,5,6\n0,7,8,9\n', 4, 4),
+    # The last line is checked even without a trailing newline
+    (b'1,2,3\n4,5', 3, 2),
+])
+def test_checked_reader_reports_the_first_bad_line(body, line, fields, size):
+    reader = _CheckedReader(io.BytesIO(body), 3)
+    with pytest.raises(ValueError, match=f'Line {line} has {fields} fields, expected 3'):
+        _read_all(reader, size)
+
+
+def test_ingest_rejects_short_rows_and_leaves_no_files(tmp_path):
+    csv_path = str(tmp_path / 'house.csv')
+    with pytest.raises(ValueError, match='Line 3 has 1 fields'):
+        ingest_csv(io.BytesIO(b'a,b\n1,2\n3\n'), csv_path, ['a', 'b'], keep_csv=True)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_ingest_rejects_uploads_without_rows(tmp_path):
+    with pytest.raises(ValueError, match='no simulation rows'):
+        ingest_csv(io.BytesIO(b'a,b\n\n'), str(tmp_path / 'house.csv'), ['a', 'b'])
+
+
+def test_ingest_stores_the_matrix(tmp_path):
+    csv_path = str(tmp_path / 'house.csv')
+    fields = ingest_csv(io.BytesIO(b'b,a\n1,2\n3,4\n'), csv_path, ['a', 'b'],
+                        chunk_rows=1)
+    assert fields['file_path'] is None
+    assert fields['simulations_count'] == 2
+    assert fields['matrix_columns'] == ['b', 'a']
+    np.testing.assert_array_equal(np.load(fields['matrix_path']), [[1, 2], [3, 4]])
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from app.utils.quantization import (decode, encode, encoding_errors, representable,
+                                    storage_params, storage_range, storage_report)
+
+
+def _values():
+    rng = np.random.default_rng(0)
+    values = np.column_stack([rng.normal(0, 1, 1000), rng.normal(2e6, 5e4, 1000),
+                              rng.uniform(-1e-6, 3e-6, 1000)])
+    values[10, 0] = np.nan
+    return values
+
+
+def _params(dtype, values):
+    return storage_params(dtype, np.nanmin(values, axis=0), np.nanmax(values, axis=0))
+
+
+@pytest.mark.parametrize('dtype', ['int16', 'int8'])
+def test_integer_round_trip_within_half_a_step(dtype):
+    values = _values()
+    storage = _params(dtype, values)
+    encoded = encode(values, storage)
+    assert encoded.dtype == np.dtype(dtype)
+
+    decoded = decode(encoded, storage)
+    np.testing.assert_array_equal(np.isnan(decoded), np.isnan(values))
+    error = np.nanmax(np.abs(decoded - values), axis=0)
+    assert (error <= np.asarray(storage['scale']) / 2 * (1 + 1e-9)).all()
+
+
+@pytest.mark.parametrize('dtype, relative', [('float32', 2.0 ** -24), ('float16', 2.0 ** -11)])
+def test_float_round_trip_within_rounding(dtype, relative):
+    values = _values()
+    storage = _params(dtype, values)
+    decoded = decode(encode(values, storage), storage)
+    np.testing.assert_array_equal(np.isnan(decoded), np.isnan(values))
+    valid = ~np.isnan(values)
+    assert (np.abs(decoded - values)[valid] <= np.abs(values)[valid] * relative).all()
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'int16', 'int8'])
+def test_encoding_keeps_the_order_of_values(dtype):
+    values = np.sort(np.random.default_rng(1).normal(size=(500, 1)), axis=0)
+    encoded = encode(values, _params(dtype, values))
+    assert (np.diff(encoded.astype(np.float64), axis=0) >= 0).all()
+
+
+def test_encoding_errors_are_the_largest_decoding_errors():
+    values = _values()
+    storage = _params('int8', values)
+    encoded = encode(values, storage)
+    absolute, relative = encoding_errors(values, encoded, storage)
+
+    error = np.abs(decode(encoded, storage) - values)
+    np.testing.assert_allclose(absolute, np.nanmax(error, axis=0))
+    np.testing.assert_allclose(relative, np.nanmax(error / np.abs(values), axis=0))
+
+
+def test_decode_selected_columns():
+    values = _values()
+    storage = _params('int16', values)
+    encoded = encode(values, storage)
+    np.testing.assert_array_equal(decode(encoded[:, [2, 0]], storage, [2, 0]),
+                                  decode(encoded, storage)[:, [2, 0]])
+
+
+def test_representable_within_the_storage_range():
+    values = _values()
+    storage = _params('int8', values)
+    lows, highs = storage_range(storage)
+    assert representable(values, storage)
+    assert not representable(highs[None, :] + np.asarray(storage['scale']), storage)
+    assert not representable(lows[None, :] - np.asarray(storage['scale']), storage)
+
+
+def test_storage_report_warns_when_errors_reach_the_spread():
+    summary = {'a': {'variance': 1.0}, 'b': {'variance': 1e-6}}
+    storage = {'dtype': 'int8', 'max_absolute_error': [0.001, 0.001],
+               'max_relative_error': [0.1, 0.2]}
+    report = storage_report(storage, ['a', 'b'], summary, warn_fraction=0.01)
+    assert report['max_error_to_std'] == pytest.approx(1.0)
+    assert 'b' in report['warning'] and 'a,' not in report['warning']
+    assert 'warning' not in storage_report(storage, ['a', 'b'], summary, ['a'])
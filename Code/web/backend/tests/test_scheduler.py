@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from app.utils.scheduler import (BATCH, INTERACTIVE, AdmissionScheduler, ServerBusy,
+                                 admission_slot, admit)
+
+
+def _scheduler(max_concurrent=2, batch_max_concurrent=1, max_queue=4, max_wait=2.0):
+    return AdmissionScheduler(max_concurrent, batch_max_concurrent,
+                              {INTERACTIVE: max_queue, BATCH: max_queue}, max_wait)
+
+
+def _wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_admits_up_to_max_concurrent_then_times_out():
+    scheduler = _scheduler(max_wait=0.05)
+    assert scheduler.acquire(INTERACTIVE) and scheduler.acquire(INTERACTIVE)
+    assert not scheduler.acquire(INTERACTIVE)
+
+    scheduler.release(INTERACTIVE, 0.1)
+    assert scheduler.acquire(INTERACTIVE)
+    metrics = scheduler.metrics()
+    assert metrics['running'] == {INTERACTIVE: 2, BATCH: 0}
+    assert metrics['admitted'][INTERACTIVE] == 3
+    assert metrics['rejected'][INTERACTIVE] == 1
+
+
+def test_full_queue_rejects_at_once():
+    scheduler = _scheduler(max_concurrent=1, max_queue=0, max_wait=10)
+    assert scheduler.acquire(INTERACTIVE)
+    start = time.monotonic()
+    assert not scheduler.acquire(INTERACTIVE)
+    assert time.monotonic() - start < 1
+
+
+def test_batch_lane_is_capped():
+    scheduler = _scheduler(max_concurrent=3, batch_max_concurrent=1, max_wait=0.05)
+    assert scheduler.acquire(BATCH)
+    assert not scheduler.acquire(BATCH)
+    # Interactive requests still get the remaining slots
+    assert scheduler.acquire(INTERACTIVE) and scheduler.acquire(INTERACTIVE)
+
+
+def test_queued_interactive_requests_go_before_batch():
+    scheduler = _scheduler(max_concurrent=1, batch_max_concurrent=1)
+    assert scheduler.acquire(INTERACTIVE)
+
+    order = []
+
+    def waiter(lane):
+        assert scheduler.acquire(lane)
+        order.append(lane)
+        scheduler.release(lane, 0.0)
+
+    batch = threading.Thread(target=waiter, args=(BATCH,))
+    batch.start()
+    _wait_for(lambda: scheduler.metrics()['queued'][BATCH] == 1)
+    interactive = threading.Thread(target=waiter, args=(INTERACTIVE,))
+    interactive.start()
+    _wait_for(lambda: scheduler.metrics()['queued'][INTERACTIVE] == 1)
+
+    scheduler.release(INTERACTIVE, 0.0)
+    batch.join(5)
+    interactive.join(5)
+    assert order == [INTERACTIVE, BATCH]
+
+
+def test_retry_after_grows_with_the_backlog():
+    scheduler = _scheduler(max_concurrent=1)
+    assert scheduler.retry_after() >= 1
+    scheduler.acquire(INTERACTIVE)
+    scheduler.release(INTERACTIVE, 30.0)
+    assert scheduler.retry_after() > 1
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.extensions['admission'] = _scheduler(max_concurrent=1, max_queue=0)
+    return app
+
+
+def test_admission_slot_holds_and_releases(app):
+    scheduler = app.extensions['admission']
+    with app.test_request_context():
+        with admission_slot():
+            assert scheduler.metrics()['running'][INTERACTIVE] == 1
+            with pytest.raises(ServerBusy):
+                with admission_slot():
+                    pass
+        assert scheduler.metrics()['running'][INTERACTIVE] == 0
+
+
+def test_admission_slot_moves_requests_to_the_batch_lane(app):
+    scheduler = app.extensions['admission']
+    with app.test_request_context(headers={'X-Priority': 'batch'}):
+        with admission_slot():
+            assert scheduler.metrics()['running'] == {INTERACTIVE: 0, BATCH: 1}
+
+
+def test_admit_answers_429_when_busy(app):
+    @admit()
+    def view():
+        return 'ok'
+
+    scheduler = app.extensions['admission']
+    with app.test_request_context():
+        assert view() == 'ok'
+        scheduler.acquire(INTERACTIVE)
+        body, status, headers = view()
+        assert status == 429
+        assert int(headers['Retry-After']) >= 1
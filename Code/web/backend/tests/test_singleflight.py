@@ -0,0 +1,74 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.singleflight import SingleFlight, canonical_key
+
+
+def _run_together(flight, key, fn, callers=5):
+    """Start `callers` calls of fn under one key while the leader is blocked"""
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def blocked():
+        calls.append(None)
+        started.set()
+        release.wait(5)
+        return fn()
+
+    with ThreadPoolExecutor(callers) as pool:
+        futures = [pool.submit(flight.do, key, blocked)]
+        started.wait(5)
+        futures += [pool.submit(flight.do, key, blocked) for _ in range(callers - 1)]
+        # Give the followers time to join the leader's call
+        time.sleep(0.2)
+        release.set()
+        outcomes = [future.exception() or future.result() for future in futures]
+    return calls, outcomes
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls, outcomes = _run_together(flight, 'k', lambda: {'value': 1})
+    assert len(calls) == 1
+    assert outcomes == [{'value': 1}] * len(outcomes)
+    assert flight.in_flight() == 0
+
+
+def test_followers_get_the_leaders_exception():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError('boom')
+
+    _, outcomes = _run_together(flight, 'k', fail)
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+    assert flight.in_flight() == 0
+
+
+def test_nothing_is_cached_after_a_call():
+    flight = SingleFlight()
+    counter = iter(range(10))
+    assert flight.do('k', next, counter) == 0
+    assert flight.do('k', next, counter) == 1
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    inside = threading.Barrier(2, timeout=5)
+
+    def meet(value):
+        # Both calls must be running at once to pass the barrier
+        inside.wait()
+        return value
+
+    with ThreadPoolExecutor(2) as pool:
+        a = pool.submit(flight.do, 'a', meet, 1)
+        b = pool.submit(flight.do, 'b', meet, 2)
+        assert (a.result(), b.result()) == (1, 2)
+
+
+def test_canonical_key_ignores_key_order():
+    assert canonical_key({'a': 1, 'b': [1, 2]}, 'x') == canonical_key({'b': [1, 2], 'a': 1}, 'x')
+    assert canonical_key({'a': 1}) != canonical_key({'a': 2})
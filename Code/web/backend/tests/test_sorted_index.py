@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from app.utils.quantization import decode, encode, storage_params
+from app.utils.sorted_index import (build_sorted_index, merge_sorted_index,
+                                    sorted_quantiles, threshold_counts, valid_values)
+
+
+def _matrix(rows=400):
+    rng = np.random.default_rng(0)
+    matrix = np.round(rng.normal(size=(rows, 2)), 2)
+    matrix[[3, 50], 0] = np.nan
+    return matrix
+
+
+def _assert_cdf(result, values, thresholds):
+    values = values[~np.isnan(values)]
+    for entry, t in zip(result, thresholds):
+        assert entry['threshold'] == t
+        assert entry['below'] == np.count_nonzero(values < t)
+        assert entry['at_most'] == np.count_nonzero(values <= t)
+        assert entry['cdf'] == pytest.approx(np.count_nonzero(values <= t) / len(values))
+
+
+THRESHOLDS = [-10.0, -0.5, 0.0, 0.01, 0.123456, 1.0, 10.0]
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_threshold_counts_match_the_empirical_cdf(tmp_path, dtype):
+    matrix = _matrix().astype(dtype)
+    path = str(tmp_path / 'h.sorted.npy')
+    build_sorted_index(matrix, path)
+    index = np.load(path, mmap_mode='r')
+    for c in range(matrix.shape[1]):
+        assert len(valid_values(index[c])) == np.count_nonzero(~np.isnan(matrix[:, c]))
+        _assert_cdf(threshold_counts(index[c], THRESHOLDS),
+                    matrix[:, c].astype(np.float64), THRESHOLDS)
+
+
+def test_threshold_counts_on_a_quantized_index(tmp_path):
+    matrix = _matrix()
+    storage = storage_params('int8', np.nanmin(matrix, axis=0), np.nanmax(matrix, axis=0))
+    encoded = encode(matrix, storage)
+    path = str(tmp_path / 'h.sorted.npy')
+    build_sorted_index(encoded, path)
+    index = np.load(path, mmap_mode='r')
+    # Thresholds are compared with the values as stored, once decoded
+    stored = decode(encoded, storage)
+    for c in range(matrix.shape[1]):
+        _assert_cdf(threshold_counts(index[c], THRESHOLDS, storage, c),
+                    stored[:, c], THRESHOLDS)
+
+
+def test_sorted_quantiles_match_numpy(tmp_path):
+    matrix = _matrix()
+    path = str(tmp_path / 'h.sorted.npy')
+    build_sorted_index(matrix, path)
+    index = np.load(path, mmap_mode='r')
+    probabilities = [0, 0.05, 0.5, 0.951, 1]
+    for c in range(matrix.shape[1]):
+        np.testing.assert_allclose(sorted_quantiles(index[c], probabilities),
+                                   np.nanquantile(matrix[:, c], probabilities))
+
+
+def test_sorted_quantiles_of_an_empty_row():
+    assert np.isnan(sorted_quantiles(np.array([np.nan, np.nan]), [0.5])).all()
+
+
+@pytest.mark.parametrize('quantized', [False, True])
+def test_merge_equals_building_from_all_rows(tmp_path, quantized):
+    matrix = _matrix(300)
+    if quantized:
+        storage = storage_params('int16', np.nanmin(matrix, axis=0), np.nanmax(matrix, axis=0))
+        matrix = encode(matrix, storage)
+    merged, built = str(tmp_path / 'merged.npy'), str(tmp_path / 'built.npy')
+    build_sorted_index(matrix[:200], merged)
+    merge_sorted_index(merged, matrix[200:])
+    build_sorted_index(matrix, built)
+    np.testing.assert_array_equal(np.load(merged), np.load(built))
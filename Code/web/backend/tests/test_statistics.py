@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from app.utils.statistics import RunningMoments
+
+
+def _moments(*blocks):
+    moments = RunningMoments(blocks[0].shape[1])
+    for block in blocks:
+        moments.update(block)
+    return moments
+
+
+def _assert_matches(moments, values):
+    df = pd.DataFrame(values)
+    np.testing.assert_array_equal(moments.count, df.count().to_numpy())
+    np.testing.assert_allclose(moments.mean, df.mean().to_numpy())
+    np.testing.assert_allclose(moments.variance(), df.var().to_numpy())
+    np.testing.assert_array_equal(moments.min, df.min().to_numpy())
+    np.testing.assert_array_equal(moments.max, df.max().to_numpy())
+
+
+def test_merge_matches_one_pass_over_all_rows():
+    rng = np.random.default_rng(0)
+    a = rng.normal(5, 2, size=(300, 3))
+    b = rng.normal(-1, 0.5, size=(70, 3))
+    b[3, 1] = np.nan
+
+    merged = _moments(a[:100], a[100:])
+    merged.merge(_moments(b))
+    _assert_matches(merged, np.vstack([a, b]))
+
+
+def test_merge_with_empty_side():
+    values = np.random.default_rng(1).normal(size=(50, 2))
+    empty = RunningMoments(2)
+    empty.merge(_moments(values))
+    _assert_matches(empty, values)
+
+    merged = _moments(values)
+    merged.merge(RunningMoments(2))
+    _assert_matches(merged, values)
+
+
+def test_merge_of_summaries_round_trip():
+    rng = np.random.default_rng(2)
+    a, b = rng.normal(size=(40, 2)), rng.normal(3, 1, size=(25, 2))
+    columns = ['x', 'y']
+    merged = RunningMoments.from_summary(_moments(a).to_summary(columns), columns)
+    merged.merge(_moments(b))
+    _assert_matches(merged, np.vstack([a, b]))
+
+
+def test_single_row_has_no_variance():
+    moments = _moments(np.array([[1.0, 2.0]]))
+    assert np.isnan(moments.variance()).all()
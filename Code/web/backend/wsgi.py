@@ -0,0 +1,16 @@
+from waitress import serve
+from app import create_app
+
+'''
+Threaded WSGI entry point: `python wsgi.py`.
+Each request runs on one of SERVER_THREADS waitress threads, so requests
+are served in parallel and the admission queue and single-flight
+coalescing see them concurrently. Views hand file I/O and engine calls
+to the app's executors.
+'''
+
+app = create_app()
+
+if __name__ == '__main__':
+    serve(app, host=app.config['SERVER_HOST'], port=app.config['SERVER_PORT'],
+          threads=app.config['SERVER_THREADS'])